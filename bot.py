@@ -1,21 +1,75 @@
+import asyncio
 import discord
 from discord.ext import commands
-from config import DISCORD_TOKEN
+from config import DISCORD_TOKEN, GUILD_CACHE_CHANGE_STREAM
+from data import riot
+from data.analytics import analytics, start_analytics_flusher
+from data.mongo import watch_guild_changes
+from data.matches import match_writer
+from data.schema import ensure_indexes
+from utils.logger import log_sink
+from utils.loop_monitor import start_event_loop_monitor
 
 # Define intents for your bot
 intents = discord.Intents.default()
 intents.messages = True
 intents.guilds = True
 
+
+class ScuttleBot(commands.AutoShardedBot):
+    async def setup_hook(self):
+        # Open the shared Riot HTTP session before any cog can make API calls
+        await riot.open_session()
+        # Create and verify the database indexes once, before any query needs them
+        try:
+            await ensure_indexes()
+        except Exception as e:
+            print(f"Failed to ensure database indexes: {e}")
+        # Track event loop lag so anything blocking the loop shows up in the metrics
+        self.loop_monitor = start_event_loop_monitor()
+        # Write command analytics in batches instead of once per interaction
+        self.analytics_flusher = start_analytics_flusher()
+        # Keep the guild configuration cache coherent with other bot processes
+        self.guild_watcher = asyncio.create_task(watch_guild_changes()) if GUILD_CACHE_CHANGE_STREAM else None
+        # Load all cogs asynchronously when the bot starts
+        await load_cogs()
+
+    async def close(self):
+        # Send the queued logs while the bot can still reach Discord
+        try:
+            await log_sink.close()
+        except Exception as e:
+            print(f"Failed to send queued logs: {e}")
+        await super().close()
+        if getattr(self, "loop_monitor", None):
+            self.loop_monitor.cancel()
+        if getattr(self, "guild_watcher", None):
+            self.guild_watcher.cancel()
+        if getattr(self, "analytics_flusher", None):
+            self.analytics_flusher.cancel()
+        # Write the command analytics counted since the last flush
+        try:
+            await analytics.flush()
+        except Exception as e:
+            print(f"Failed to flush command analytics: {e}")
+        # Write the ingested matches still buffered
+        try:
+            await match_writer.close()
+        except Exception as e:
+            print(f"Failed to flush buffered match writes: {e}")
+        # Close the shared Riot HTTP session once the bot has disconnected
+        await riot.close_session()
+
+
 # Initialize the bot with command prefix and intents
-bot = commands.AutoShardedBot(command_prefix="/", intents=intents)
+bot = ScuttleBot(command_prefix="/", intents=intents)
 
 # Function to load cogs
 async def load_cogs():
     cogs = [
         'extensions.events',
         'cogs.summoners', 'cogs.basic', 'cogs.stats', 'cogs.reports',
-        'tasks.reports'
+        'tasks.reports', 'tasks.ingestion'
     ]
     for cog in cogs:
         try:
@@ -24,11 +78,6 @@ async def load_cogs():
         except Exception as e:
             print(f"Failed to load cog {cog}: {e}")
 
-@bot.event
-async def setup_hook():
-    # Load all cogs asynchronously when the bot starts
-    await load_cogs()
-
 # Start the bot using bot.run(), which correctly manages event loop and cog loading
 if __name__ == "__main__":
     bot.run(DISCORD_TOKEN)
@@ -36,7 +36,7 @@ class Basic(commands.Cog):
             embed.add_field(name=command, value=description, inline=False)
 
         embed.set_footer(
-            text="📝 Note: match data is updated hourly on the hour. If you add a new summoner to your Guild, expect to see stats at the next hour."
+            text="📝 Note: match data is updated every few minutes. If you add a new summoner to your Guild, expect to see stats within a few minutes."
         )
 
         await interaction.response.send_message(embed=embed)
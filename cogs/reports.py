@@ -6,7 +6,9 @@ from discord import app_commands
 import traceback
 
 import utils.logger as logger
-from data.mongo import get_summoners, fetch_report_by_day_range,is_summoner_cached, get_guild_by_id
+import utils.metrics as metrics
+from data.mongo import get_guild_by_id
+from data.reports import fetch_guild_report
 
 class Reports(commands.Cog):
     def __init__(self, bot):
@@ -17,6 +19,7 @@ class Reports(commands.Cog):
         self.reports_group.command(name="weekly", description="Displays a weekly report comparing the stats of all summoners in your Guild.")(self.weekly)
         self.reports_group.command(name="monthly", description="Displays a monthly report comparing the stats of all summoners in your Guild.")(self.monthly)
         self.reports_group.command(name="admin", description="This command is only for the bot admin.")(self.admin)
+        self.reports_group.command(name="metrics", description="This command is only for the bot admin.")(self.bot_metrics)
         self.bot.tree.add_command(self.reports_group)
 
     async def weekly(self, interaction: discord.Interaction):
@@ -32,6 +35,39 @@ class Reports(commands.Cog):
         # Admin commands should use a specific guild ID and require admin permissions
         await self._generate_and_send_report(interaction, day_range=30, guild_id=int(guild_id), is_admin=True)
 
+    async def bot_metrics(self, interaction: discord.Interaction):
+        try:
+            # Check if the user is the bot admin
+            if interaction.user.id != OWNER_ID:
+                error_embed = discord.Embed(
+                    title=f"❌ Metrics Command",
+                    description="This command is only for the bot admin.",
+                    color=discord.Color.green(),
+                )
+                await interaction.response.send_message(embed=error_embed, ephemeral=True)
+                await logger.command(self.bot, interaction, output_embed=error_embed)
+                return
+
+            # One field per kind of metric, in code blocks cut to the field length limit
+            snapshot = metrics.snapshot()
+            embed = discord.Embed(
+                title=f"📊 Bot Metrics",
+                description="Internal performance metrics of this process since it started.",
+                color=discord.Color.green(),
+            )
+            for kind in ["counters", "gauges", "histograms"]:
+                lines = [f"{name}: {value}" for name, value in sorted(snapshot[kind].items())] or ["None recorded"]
+                value = "\n".join(lines)
+                if len(value) > 1000:
+                    value = value[:1000].rsplit("\n", 1)[0] + "\n..."
+                embed.add_field(name=kind.capitalize(), value=f"```{value}```", inline=False)
+
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+            await logger.command(self.bot, interaction, output_embed=embed)
+        except Exception as e:
+            stack_trace = traceback.format_exc()
+            await logger.error(self.bot, interaction, stack_trace, e)
+
     async def _generate_and_send_report(self, interaction: discord.Interaction, day_range: int, guild_id: int = None, is_admin: bool = False):
         try:
             # Ensure the command is being called from a discord server
@@ -72,19 +108,13 @@ class Reports(commands.Cog):
                 guild_name = interaction.guild or "None"
                 guild_id = interaction.guild_id
 
-            # Fetch the report stats
-            stats = await fetch_report_by_day_range(guild_id, range=day_range)
-
-            if stats:
-                summoners_not_cached = []
-                summoners = await get_summoners(guild_id)
-                summoners_names = [summoner["name"] for summoner in summoners]
+            # Fetch the report, a weekly report precomputed for the automated report is reused
+            report = await fetch_guild_report(guild_id, range=day_range)
 
-                # Check for cached summoners
-                for summoner in summoners:
-                    is_cached = await is_summoner_cached(puuid=summoner["puuid"])
-                    if not is_cached:
-                        summoners_not_cached.append(summoner["name"])
+            if report:
+                stats = report["stats"]
+                summoners_not_cached = report["summoners_not_cached"]
+                summoners_names = report["summoners"]
 
                 embed = discord.Embed(
                     title=f"📈 Server {guild_name}'s report for the past {day_range} days.",
@@ -117,7 +147,7 @@ class Reports(commands.Cog):
                         summoners_not_cached_embed.add_field(name="", value=name, inline=True)
                     embeds_arr.append(summoners_not_cached_embed)
 
-                embed.set_footer(text="📝 Note: match data is updated hourly on the hour.")
+                embed.set_footer(text="📝 Note: match data is updated every few minutes.")
 
                 await interaction.followup.send(embeds=embeds_arr)
                 await logger.command(self.bot, interaction, output_embeds=embeds_arr)
@@ -6,8 +6,10 @@ from discord import app_commands
 import traceback
 
 import utils.logger as logger
-from data.mongo import get_summoners, is_summoner_cached, fetch_summoner_stats_by_day_range
-from data.riot import fetch_summoner_puuid_by_riot_id
+from utils.stats import STATS
+from data.mongo import get_summoners, is_summoner_cached, fetch_summoner_stats_by_day_range, resolve_summoner_puuid
+from data.ingestion import bump_summoner
+from utils.scheduler import PRIORITY_QUERIED
 
 class Stats(commands.Cog):
     def __init__(self, bot):
@@ -54,7 +56,7 @@ class Stats(commands.Cog):
             summoner_riot_id = f"{summoner_name} #{tag}"
 
             # Make sure riot id exists
-            puuid = await fetch_summoner_puuid_by_riot_id(summoner_riot_id)
+            puuid = await resolve_summoner_puuid(summoner_riot_id)
 
             if puuid:
                 summoners_in_guild = await get_summoners(guild_id)
@@ -70,12 +72,16 @@ class Stats(commands.Cog):
                     await logger.command(self.bot, interaction, output_embed=embed)
                     return
 
+                # Summoners people look at get their matches refreshed first
+                summoner = next(summoner for summoner in summoners_in_guild if summoner['puuid'] == puuid)
+                bump_summoner(puuid, PRIORITY_QUERIED, summoner.get('region'))
+
                 summoner_cached = await is_summoner_cached(puuid)
 
                 if not summoner_cached:
                     embed = discord.Embed(
                         title=f"⏱️ Stats Command",
-                        description=f"Summoner **{summoner_riot_id}** has been added recently and does not have match data yet. Please allow about 1 hour.",
+                        description=f"Summoner **{summoner_riot_id}** has been added recently and does not have match data yet. Please allow a few minutes.",
                         color=discord.Color.green(),
                     )
                     await interaction.followup.send(embed=embed)
@@ -88,10 +94,10 @@ class Stats(commands.Cog):
                     description=f"Collected stats for {summoner_riot_id}'s Ranked Solo Queue matches over the past {day_range} day(s).",
                     color=discord.Color.green(),
                 )
-                for key, value in stats.items():
-                    embed.add_field(name=key, value=value)
+                for stat in STATS:
+                    embed.add_field(name=stat.label, value=stats[stat.label])
 
-                embed.set_footer(text="📝 Note: match data is updated hourly on the hour.")
+                embed.set_footer(text="📝 Note: match data is updated every few minutes.")
 
                 await interaction.followup.send(embed=embed)
                 await logger.command(self.bot, interaction, output_embed=embed)
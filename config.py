@@ -12,6 +12,9 @@ GUILD_JOIN_CHANNEL_ID=os.getenv("GUILD_JOIN_CHANNEL_ID")
 GUILD_LEAVE_CHANNEL_ID=os.getenv("GUILD_LEAVE_CHANNEL_ID")
 GUILD_ERROR_CHANNEL_ID=os.getenv("GUILD_ERROR_CHANNEL_ID")
 GUILD_LOGS_CHANNEL_ID=os.getenv("GUILD_LOGS_CHANNEL_ID")
+# Logs sent to the log channels are queued, this many embeds at most, and sent after waiting this many seconds for a burst
+LOG_SINK_MAX_EMBEDS=int(os.getenv("LOG_SINK_MAX_EMBEDS", 500))
+LOG_SINK_COALESCE_SECONDS=float(os.getenv("LOG_SINK_COALESCE_SECONDS", 1))
 
 SUPPORT_GUILD_LINK=os.getenv("SUPPORT_GUILD_LINK")
 
@@ -19,4 +22,89 @@ TOPGG_TOKEN=os.getenv("TOPGG_TOKEN")
 TOPGG_ID=os.getenv("TOPGG_ID")
 
 RIOT_API_KEY=os.getenv("RIOT_API_KEY")
-MONGO_DB_URI=os.getenv("MONGO_DB_URI")
\ No newline at end of file
+# Base URL of the Riot API, {host} is replaced by the platform (e.g. na1) or regional routing value (e.g. americas)
+# Can point at a local fake Riot server for testing, e.g. http://localhost:8080/{host}
+RIOT_API_BASE_URL=os.getenv("RIOT_API_BASE_URL", "https://{host}.api.riotgames.com")
+MONGO_DB_URI=os.getenv("MONGO_DB_URI")
+# Riot HTTP client connection pool tuning
+RIOT_POOL_LIMIT=int(os.getenv("RIOT_POOL_LIMIT", 100))
+RIOT_POOL_LIMIT_PER_HOST=int(os.getenv("RIOT_POOL_LIMIT_PER_HOST", 20))
+RIOT_DNS_CACHE_TTL=int(os.getenv("RIOT_DNS_CACHE_TTL", 300))
+RIOT_KEEPALIVE_TIMEOUT=float(os.getenv("RIOT_KEEPALIVE_TIMEOUT", 30))
+RIOT_REQUEST_TIMEOUT=float(os.getenv("RIOT_REQUEST_TIMEOUT", 10))
+
+# Riot rate limiting, the default app limit is used until Riot reports the key's real limits
+RIOT_DEFAULT_APP_RATE_LIMIT=os.getenv("RIOT_DEFAULT_APP_RATE_LIMIT", "20:1,100:120")
+RIOT_MAX_RETRIES=int(os.getenv("RIOT_MAX_RETRIES", 3))
+RIOT_REGION_PROBE_CONCURRENCY=int(os.getenv("RIOT_REGION_PROBE_CONCURRENCY", 4))
+
+# Summoner resolution cache (riot id -> puuid, puuid -> region), TTLs are in seconds
+RESOLUTION_CACHE_SIZE=int(os.getenv("RESOLUTION_CACHE_SIZE", 10000))
+RESOLUTION_CACHE_TTL=int(os.getenv("RESOLUTION_CACHE_TTL", 86400))
+REGION_CACHE_TTL=int(os.getenv("REGION_CACHE_TTL", 604800))
+RESOLUTION_NEGATIVE_TTL=int(os.getenv("RESOLUTION_NEGATIVE_TTL", 600))
+
+# In-memory guild configuration cache, size and time to live in seconds
+# GUILD_CACHE_CHANGE_STREAM keeps it coherent across bot processes (needs a MongoDB replica set)
+GUILD_CACHE_SIZE=int(os.getenv("GUILD_CACHE_SIZE", 5000))
+GUILD_CACHE_TTL=int(os.getenv("GUILD_CACHE_TTL", 300))
+GUILD_CACHE_CHANGE_STREAM=os.getenv("GUILD_CACHE_CHANGE_STREAM", "false").lower() == "true"
+
+# Where summoner stats are calculated: "python", "mongo" (aggregation pipeline), "rollup" (daily rollups)
+# or "numpy" (vectorized)
+STATS_ENGINE=os.getenv("STATS_ENGINE", "python")
+# Match documents stored up to this many hours before a summoner's rollup watermark are re-checked
+ROLLUP_LOOKBACK_HOURS=int(os.getenv("ROLLUP_LOOKBACK_HOURS", 1))
+# Cache of calculated stats and reports: number of entries and time to live in seconds
+# RESULT_CACHE_SHARED also stores them in MongoDB so every bot process benefits
+RESULT_CACHE_SIZE=int(os.getenv("RESULT_CACHE_SIZE", 5000))
+RESULT_CACHE_TTL=int(os.getenv("RESULT_CACHE_TTL", 600))
+RESULT_CACHE_SHARED=os.getenv("RESULT_CACHE_SHARED", "false").lower() == "true"
+
+# Where stored matches are read from: "legacy" (cached_match_data), "dual" (match_slices for summoners
+# already migrated, cached_match_data for the others) or "slices" (match_slices)
+MATCH_STORAGE=os.getenv("MATCH_STORAGE", "legacy")
+
+# Match ingestion, a tracked summoner's matches are refreshed every INGESTION_INTERVAL_MINUTES
+# Summoners whose refreshes keep finding no new match back off exponentially, up to INGESTION_MAX_BACKOFF_MINUTES
+INGESTION_INTERVAL_MINUTES=int(os.getenv("INGESTION_INTERVAL_MINUTES", 5))
+INGESTION_MAX_BACKOFF_MINUTES=int(os.getenv("INGESTION_MAX_BACKOFF_MINUTES", 360))
+# How often the ingestion queue is checked for due summoners
+INGESTION_TICK_SECONDS=int(os.getenv("INGESTION_TICK_SECONDS", 30))
+# Maximum number of summoners refreshed, and of Riot API calls made, per tick
+INGESTION_BATCH_SIZE=int(os.getenv("INGESTION_BATCH_SIZE", 50))
+INGESTION_CALL_BUDGET=int(os.getenv("INGESTION_CALL_BUDGET", 200))
+# Members of guilds with an automated report are refreshed this many minutes before it is sent
+INGESTION_REPORT_LEAD_MINUTES=int(os.getenv("INGESTION_REPORT_LEAD_MINUTES", 60))
+# Queue the matches are fetched for, 420 is Ranked Solo Queue
+INGESTION_QUEUE_ID=int(os.getenv("INGESTION_QUEUE_ID", 420))
+# How far back matches are fetched for a summoner ingested for the first time
+INGESTION_INITIAL_LOOKBACK_DAYS=int(os.getenv("INGESTION_INITIAL_LOOKBACK_DAYS", 30))
+# Number of summoners whose match ids are fetched at the same time
+INGESTION_CONCURRENCY=int(os.getenv("INGESTION_CONCURRENCY", 8))
+# How long a summoner whose matches were not ingested yet is remembered as such, in seconds
+CACHE_STATUS_NEGATIVE_TTL=int(os.getenv("CACHE_STATUS_NEGATIVE_TTL", 60))
+# Ingested matches are written in bulk once this many writes are buffered, or this many seconds after the first one
+MATCH_WRITE_BATCH_SIZE=int(os.getenv("MATCH_WRITE_BATCH_SIZE", 1000))
+MATCH_WRITE_MAX_DELAY_SECONDS=float(os.getenv("MATCH_WRITE_MAX_DELAY_SECONDS", 5))
+
+# Automated weekly report, sent on this weekday (0 is Monday) at this hour
+WEEKLY_REPORT_WEEKDAY=int(os.getenv("WEEKLY_REPORT_WEEKDAY", 6))
+WEEKLY_REPORT_HOUR=int(os.getenv("WEEKLY_REPORT_HOUR", 20))
+# Command analytics are counted in memory and written every ANALYTICS_FLUSH_SECONDS
+# ANALYTICS_DAILY also keeps per day counts, per guild counts and latency histograms
+ANALYTICS_FLUSH_SECONDS=int(os.getenv("ANALYTICS_FLUSH_SECONDS", 60))
+ANALYTICS_DAILY=os.getenv("ANALYTICS_DAILY", "true").lower() == "true"
+
+# Number of guilds whose automated report is computed and sent at the same time
+REPORT_CONCURRENCY=int(os.getenv("REPORT_CONCURRENCY", 8))
+# Automated weekly reports are precomputed at random times during the REPORT_PRECOMPUTE_LEAD_MINUTES before they are sent,
+# after the members' matches were refreshed (see INGESTION_REPORT_LEAD_MINUTES)
+REPORT_PRECOMPUTE_LEAD_MINUTES=int(os.getenv("REPORT_PRECOMPUTE_LEAD_MINUTES", 30))
+# Precomputed reports are used by automated reports and /reports for this many minutes
+REPORT_SNAPSHOT_MAX_AGE_MINUTES=int(os.getenv("REPORT_SNAPSHOT_MAX_AGE_MINUTES", 60))
+
+# Limits for messages the bot sends on its own, in Riot's "count:seconds" format
+# Kept under Discord's global request limit so replies to commands still get through
+DISCORD_GLOBAL_SEND_LIMIT=os.getenv("DISCORD_GLOBAL_SEND_LIMIT", "30:1")
+DISCORD_CHANNEL_SEND_LIMIT=os.getenv("DISCORD_CHANNEL_SEND_LIMIT", "5:5")
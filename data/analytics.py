@@ -0,0 +1,112 @@
+import asyncio
+import bisect
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from pymongo import UpdateOne
+
+from config import ANALYTICS_DAILY, ANALYTICS_FLUSH_SECONDS
+from data.database import db
+import utils.metrics as metrics
+
+# Command analytics, counted in memory and written behind in batches instead of one upsert per interaction
+#   command_analytics: total calls per command (command_name, times_called)
+#   command_analytics_daily (ANALYTICS_DAILY): one document per (UTC day, command), _id is "<day>:<command_name>"
+#       times_called, guilds.<guild_id> calls per guild, latency.<bucket> a latency histogram (bucket upper bounds
+#       in milliseconds, "inf" above the largest one), latency_count and latency_sum in seconds
+
+# Latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2.5, 5, 10, 30)
+LATENCY_FIELDS = [f"latency.le_{int(bound * 1000)}ms" for bound in LATENCY_BUCKETS] + ["latency.inf"]
+
+
+class CommandAnalytics:
+    def __init__(self, daily=True):
+        self.daily = daily
+        self._calls = Counter()  # command name -> calls
+        self._daily = defaultdict(Counter)  # (day, command name) -> {field: increment}
+
+    # Counts a call of a command
+    def record(self, command_name, guild_id=None):
+        self._calls[command_name] += 1
+        if self.daily:
+            increments = self._daily[(_today(), command_name)]
+            increments["times_called"] += 1
+            if guild_id is not None:
+                increments[f"guilds.{guild_id}"] += 1
+
+    # Records how long a command took, from the interaction's creation to the command's completion
+    def observe_latency(self, command_name, seconds):
+        metrics.observe(f"commands.{command_name}.seconds", seconds)
+        if self.daily:
+            increments = self._daily[(_today(), command_name)]
+            increments[LATENCY_FIELDS[bisect.bisect_left(LATENCY_BUCKETS, seconds)]] += 1
+            increments["latency_count"] += 1
+            increments["latency_sum"] += seconds
+
+    # Writes everything counted since the last flush with one bulk_write of $inc per collection
+    # Counts that could not be written are kept for the next flush
+    async def flush(self):
+        calls, daily = self._calls, self._daily
+        self._calls, self._daily = Counter(), defaultdict(Counter)
+        if not calls and not daily:
+            return
+
+        started = time.perf_counter()
+        try:
+            if calls:
+                await db.command_analytics.bulk_write(
+                    [
+                        UpdateOne({"command_name": command_name}, {"$inc": {"times_called": count}}, upsert=True)
+                        for command_name, count in calls.items()
+                    ],
+                    ordered=False,
+                )
+                calls = Counter()
+
+            if daily:
+                await db.command_analytics_daily.bulk_write(
+                    [
+                        UpdateOne(
+                            {"_id": f"{day}:{command_name}"},
+                            {
+                                "$setOnInsert": {"day": day, "command_name": command_name},
+                                "$inc": dict(increments),
+                            },
+                            upsert=True,
+                        )
+                        for (day, command_name), increments in daily.items()
+                    ],
+                    ordered=False,
+                )
+        except Exception:
+            metrics.incr("analytics.flush_failures")
+            self._calls.update(calls)
+            for key, increments in daily.items():
+                self._daily[key].update(increments)
+            raise
+        finally:
+            metrics.observe("analytics.flush_seconds", time.perf_counter() - started)
+
+
+def _today():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+# Aggregator shared by every command of this process
+analytics = CommandAnalytics(daily=ANALYTICS_DAILY)
+
+
+# Flushes the analytics every interval seconds, until cancelled
+async def flush_analytics_periodically(interval=ANALYTICS_FLUSH_SECONDS):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await analytics.flush()
+        except Exception as e:
+            print(f"Failed to flush command analytics: {e}")
+
+
+# Starts the periodic analytics flush as a background task on the running loop
+def start_analytics_flusher(interval=ANALYTICS_FLUSH_SECONDS):
+    return asyncio.create_task(flush_analytics_periodically(interval))
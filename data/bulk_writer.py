@@ -0,0 +1,116 @@
+import asyncio
+import time
+from pymongo.errors import BulkWriteError
+
+from data.database import db
+import utils.metrics as metrics
+
+# Duplicate key error code, raised when two upserts race to insert the same document under a unique index
+DUPLICATE_KEY = 11000
+
+# Histogram buckets for the number of operations written per flush
+BATCH_SIZE_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+# Buffers write operations for several collections and writes them with one bulk_write(ordered=False) per collection
+# A flush happens once max_operations are buffered (see flush_if_full()) or max_delay seconds after the first buffered one
+# Collections are written in the order of collection_names, so e.g. high-water marks can be written after the matches
+# they cover, and a failed write drops the later collections' operations of the same flush
+# Upserts failing on a duplicate key lost a race with another insert of the same document and are retried once,
+# the retry matches the document that won so it leaves the same result
+# after_flush() callbacks run once the operations buffered before them are written, e.g. to publish what was stored
+# Records "<name>.flush_seconds", "<name>.batch_size", "<name>.duplicates_retried" and "<name>.write_errors"
+class BulkWriter:
+    def __init__(self, name, collection_names, max_operations=1000, max_delay=5):
+        self.name = name
+        self.collection_names = list(collection_names)
+        self.max_operations = max_operations
+        self.max_delay = max_delay
+        self._buffer = {collection_name: [] for collection_name in self.collection_names}
+        self._buffered = 0
+        self._callbacks = []
+        self._lock = asyncio.Lock()
+        self._timer = None
+
+    def __len__(self):
+        return self._buffered
+
+    # Buffers operations for a collection, the first buffered operation starts the max_delay timer
+    def add(self, collection_name, operations):
+        operations = list(operations)
+        if not operations:
+            return
+
+        self._buffer[collection_name].extend(operations)
+        self._buffered += len(operations)
+        if self._timer is None or self._timer.done():
+            self._timer = asyncio.ensure_future(self._flush_later())
+
+    # Calls callback() after the flush writing every operation buffered so far, if that flush succeeds
+    def after_flush(self, callback):
+        self._callbacks.append(callback)
+
+    # Flushes once max_operations are buffered
+    # Called after adding a unit of related operations so they are written in the same flush
+    async def flush_if_full(self):
+        if self._buffered >= self.max_operations:
+            await self.flush()
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.max_delay)
+        # Operations added while this flush writes start their own timer
+        self._timer = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Error flushing {self.name}: {e}")
+
+    # Writes every buffered operation, returns the number of operations written
+    async def flush(self):
+        async with self._lock:
+            if not self._buffered and not self._callbacks:
+                return 0
+
+            buffer, batch_size, callbacks = self._buffer, self._buffered, self._callbacks
+            self._buffer = {collection_name: [] for collection_name in self.collection_names}
+            self._buffered = 0
+            self._callbacks = []
+
+            started = time.perf_counter()
+            try:
+                for collection_name in self.collection_names:
+                    if buffer[collection_name]:
+                        await self._write(db[collection_name], buffer[collection_name])
+            finally:
+                metrics.observe(f"{self.name}.flush_seconds", time.perf_counter() - started)
+                metrics.observe(f"{self.name}.batch_size", batch_size, BATCH_SIZE_BUCKETS)
+
+            for callback in callbacks:
+                callback()
+            return batch_size
+
+    # Flushes what is left and stops the timer, e.g. when the bot shuts down
+    async def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        await self.flush()
+
+    async def _write(self, collection, operations):
+        try:
+            await collection.bulk_write(operations, ordered=False)
+            return
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+
+        duplicates = [operations[error["index"]] for error in errors if error.get("code") == DUPLICATE_KEY]
+        failures = len(errors) - len(duplicates)
+        if duplicates:
+            metrics.incr(f"{self.name}.duplicates_retried", len(duplicates))
+            try:
+                await collection.bulk_write(duplicates, ordered=False)
+            except BulkWriteError as e:
+                failures += len(e.details.get("writeErrors", []))
+
+        if failures:
+            metrics.incr(f"{self.name}.write_errors", failures)
+            raise RuntimeError(f"{failures} writes to {collection.name} failed")
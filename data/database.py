@@ -0,0 +1,16 @@
+import os
+from motor.motor_asyncio import AsyncIOMotorClient
+from dotenv import load_dotenv
+import certifi
+
+# Load environment variables from .env file
+load_dotenv()
+ca = certifi.where()
+
+
+# Motor wraps PyMongo with a non-blocking API, so database round trips never block the event loop
+# Shared by every module of the data layer
+# MONGO_DB_NAME selects another database than the bot's, e.g. for scripts seeding test data
+client = AsyncIOMotorClient(os.getenv("MONGO_DB_URI"), tlsCAFile=ca)
+DATABASE_NAME = os.getenv("MONGO_DB_NAME", "league_discord_bot")
+db = client[DATABASE_NAME]
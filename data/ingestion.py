@@ -0,0 +1,324 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from pymongo import UpdateOne
+
+from config import (
+    CACHE_STATUS_NEGATIVE_TTL,
+    INGESTION_BATCH_SIZE,
+    INGESTION_CALL_BUDGET,
+    INGESTION_CONCURRENCY,
+    INGESTION_INITIAL_LOOKBACK_DAYS,
+    INGESTION_INTERVAL_MINUTES,
+    INGESTION_MAX_BACKOFF_MINUTES,
+    INGESTION_QUEUE_ID,
+    INGESTION_REPORT_LEAD_MINUTES,
+    STATS_ENGINE,
+    WEEKLY_REPORT_HOUR,
+    WEEKLY_REPORT_WEEKDAY,
+)
+from data.database import db
+from data.matches import buffer_matches, load_stored_matches, match_writer, stored_match_pairs
+from data.riot import REGION_ROUTING, fetch_match, fetch_match_ids, get_summoner_region
+from data.rollups import refresh_rollups
+import utils.metrics as metrics
+from utils.cache import LRUCache
+from utils.scheduler import PRIORITY_REPORT, RefreshScheduler
+
+# Match ingestion, keeps the stored matches of every tracked summoner up to date from match-v5
+# Each summoner's high-water mark (start_time, epoch seconds) is kept on their cached_match_data_timestamps document
+# Only matches started at or after it are listed, and only match ids not stored yet for the summoner are fetched
+# A match listed for several tracked summoners is fetched once and stored for all of them
+# Summoners are refreshed in priority order by the scheduler below, see bump_summoner()
+
+# Matches are only listed once they are over, the high-water mark stays this far behind the listing time
+# so a game that was still in progress is listed by the next cycle
+IN_PROGRESS_GRACE = timedelta(hours=2)
+
+# Queue of tracked summoners waiting for a match refresh
+scheduler = RefreshScheduler(
+    "ingestion", INGESTION_INTERVAL_MINUTES * 60, INGESTION_MAX_BACKOFF_MINUTES * 60
+)
+# Region of every summoner in the queue
+summoner_regions = {}
+# time.monotonic() of the last sync with the guilds' summoner lists
+_last_sync = None
+# Date of the last automated report whose members were bumped
+_report_bumped_for = None
+# Whether a summoner's matches have been ingested at least once, {puuid: bool}
+# A summoner never goes back to not cached, so True is kept until evicted and False only for CACHE_STATUS_NEGATIVE_TTL
+# seconds, ingestion sets True once the match_writer flush storing a summoner's first matches and timestamps succeeds
+cache_status = LRUCache(maxsize=100000)
+
+
+# Returns every summoner tracked by a guild, as {puuid: region}
+async def get_tracked_summoners():
+    pipeline = [
+        {"$unwind": "$summoners"},
+        {"$group": {"_id": "$summoners.puuid", "region": {"$first": "$summoners.region"}}},
+    ]
+    documents = await db.discord_servers.aggregate(pipeline).to_list(length=None)
+    return {document["_id"]: document["region"] for document in documents if document["_id"]}
+
+
+# Reloads the tracked summoners into the queue, summoners no guild tracks anymore are dropped
+async def sync_tracked_summoners():
+    global _last_sync
+    summoners = await get_tracked_summoners()
+    summoner_regions.clear()
+    summoner_regions.update(summoners)
+    scheduler.sync(summoners)
+    _last_sync = time.monotonic()
+
+
+# Returns the summoners, out of summoner_puuids, whose matches have been ingested at least once
+# Summoners missing from cache_status are looked up with a single query
+async def get_cached_summoners(summoner_puuids):
+    cached = set()
+    unknown = []
+    for puuid in summoner_puuids:
+        status = cache_status.get(puuid)
+        if status is None:
+            unknown.append(puuid)
+        elif status:
+            cached.add(puuid)
+
+    if unknown:
+        documents = await db.cached_match_data_timestamps.find(
+            {"puuid": {"$in": unknown}}, {"_id": 0, "puuid": 1}
+        ).to_list(length=None)
+        found = {document["puuid"] for document in documents}
+        for puuid in unknown:
+            if puuid in found:
+                cache_status.set(puuid, True)
+            else:
+                cache_status.set(puuid, False, ttl=CACHE_STATUS_NEGATIVE_TTL)
+        cached |= found
+
+    metrics.incr("ingestion.cache_status.hits", len(summoner_puuids) - len(unknown))
+    metrics.incr("ingestion.cache_status.misses", len(unknown))
+    return cached
+
+
+# Returns the data version of each of the given summoners, {puuid: version}
+# The version is when ingestion last stored new matches for the summoner, None for summoners ingested before it
+# was recorded or not ingested yet. Results calculated from a summoner's matches stay valid while it does not change
+async def summoner_data_versions(summoner_puuids):
+    documents = await db.cached_match_data_timestamps.find(
+        {"puuid": {"$in": summoner_puuids}}, {"_id": 0, "puuid": 1, "matches_updated_at": 1}
+    ).to_list(length=None)
+    versions = {puuid: None for puuid in summoner_puuids}
+    for document in documents:
+        updated_at = document.get("matches_updated_at")
+        versions[document["puuid"]] = updated_at.timestamp() if updated_at else None
+    return versions
+
+
+# Moves a summoner to the front of the ingestion queue with the given priority (see utils.scheduler)
+def bump_summoner(summoner_puuid, priority, region=None):
+    if region:
+        summoner_regions[summoner_puuid] = region
+    scheduler.bump(summoner_puuid, priority)
+
+
+# Bumps the members of every guild with an automated report channel, once per report
+# Runs during the INGESTION_REPORT_LEAD_MINUTES before the weekly report so it is sent with fresh matches
+async def bump_report_guilds():
+    global _report_bumped_for
+    now = datetime.now()
+    minutes_until_report = WEEKLY_REPORT_HOUR * 60 - (now.hour * 60 + now.minute)
+    if now.weekday() != WEEKLY_REPORT_WEEKDAY or not 0 < minutes_until_report <= INGESTION_REPORT_LEAD_MINUTES:
+        return
+    if _report_bumped_for == now.date():
+        return
+
+    _report_bumped_for = now.date()
+    cursor = db.discord_servers.find(
+        {"main_channel_id": {"$ne": None}}, {"_id": 0, "summoners.puuid": 1, "summoners.region": 1}
+    )
+    bumped = 0
+    async for guild in cursor:
+        for summoner in guild.get("summoners", []):
+            bump_summoner(summoner["puuid"], PRIORITY_REPORT, summoner.get("region"))
+            bumped += 1
+    print(f"Bumped {bumped} summoners ahead of the weekly report.")
+
+
+# Runs one ingestion tick, refreshing the most urgent due summoners within the per tick budget
+async def run_ingestion_cycle():
+    if _last_sync is None or time.monotonic() - _last_sync >= INGESTION_INTERVAL_MINUTES * 60:
+        await sync_tracked_summoners()
+    await bump_report_guilds()
+
+    due = scheduler.pop_due(INGESTION_BATCH_SIZE)
+    if not due:
+        return None
+
+    try:
+        summary = await ingest_summoners(
+            {puuid: summoner_regions.get(puuid) for puuid in due}, call_budget=INGESTION_CALL_BUDGET
+        )
+    except Exception:
+        for puuid in due:
+            scheduler.retry(puuid)
+        raise
+
+    for puuid in due:
+        new_matches = summary["results"].get(puuid)
+        if new_matches is None:
+            scheduler.retry(puuid)
+        else:
+            scheduler.complete(puuid, found_new=new_matches > 0)
+    return summary
+
+
+# Looks up the region of the given summoners ({puuid: region}) that have none and stores it on their guild entries
+# Returns the summoners whose region is known, the others are left for a later refresh
+async def resolve_missing_regions(summoners):
+    missing = [puuid for puuid, region in summoners.items() if region not in REGION_ROUTING]
+    if not missing:
+        return summoners
+
+    semaphore = asyncio.Semaphore(INGESTION_CONCURRENCY)
+
+    async def resolve(puuid):
+        async with semaphore:
+            return puuid, await get_summoner_region(puuid)
+
+    summoners = dict(summoners)
+    for puuid, region in await asyncio.gather(*(resolve(puuid) for puuid in missing)):
+        if not region:
+            metrics.incr("ingestion.unresolved_regions")
+            del summoners[puuid]
+            continue
+
+        summoners[puuid] = summoner_regions[puuid] = region
+        await db.discord_servers.update_many(
+            {"summoners.puuid": puuid}, {"$set": {"summoners.$.region": region}}
+        )
+        print(f"Resolved the missing region of summoner {puuid} to {region}.")
+    return summoners
+
+
+# Marks summoners whose matches have been ingested, see cache_status
+def _mark_cached(summoner_puuids):
+    for puuid in summoner_puuids:
+        cache_status.set(puuid, True)
+
+
+# Fetches and stores the new matches of the given summoners ({puuid: region})
+# Summoners without a known region are resolved first, the ones that cannot be are not listed
+# call_budget caps the Riot API calls made, matches over the budget are left for the next refresh
+# Returns a summary of the cycle, its "results" map each summoner to the number of new matches stored
+# or None when they are not up to date (failed listing or matches left unfetched)
+async def ingest_summoners(summoners, call_budget=None):
+    started = time.perf_counter()
+    listed_at = datetime.now(timezone.utc)
+    summoner_puuids = list(summoners)
+    summoners = await resolve_missing_regions(summoners)
+
+    states = await db.cached_match_data_timestamps.find(
+        {"puuid": {"$in": summoner_puuids}}, {"_id": 0, "puuid": 1, "start_time": 1}
+    ).to_list(length=None)
+    high_water_marks = {state["puuid"]: state.get("start_time") for state in states}
+    initial_start_time = int((listed_at - timedelta(days=INGESTION_INITIAL_LOOKBACK_DAYS)).timestamp())
+
+    # List every summoner's new match ids, a failed listing leaves the summoner for the next cycle
+    semaphore = asyncio.Semaphore(INGESTION_CONCURRENCY)
+
+    async def list_match_ids(puuid):
+        async with semaphore:
+            start_time = high_water_marks.get(puuid) or initial_start_time
+            return puuid, await fetch_match_ids(puuid, summoners[puuid], start_time, INGESTION_QUEUE_ID)
+
+    listed = dict(await asyncio.gather(*(list_match_ids(puuid) for puuid in summoners)))
+    match_ids_by_summoner = {puuid: match_ids for puuid, match_ids in listed.items() if match_ids is not None}
+
+    # Keep the (summoner, match) pairs that are not stored yet, grouped by match
+    owners = {}
+    for puuid, match_ids in match_ids_by_summoner.items():
+        for match_id in match_ids:
+            owners.setdefault(match_id, []).append(puuid)
+    stored = await stored_match_pairs(list(match_ids_by_summoner), list(owners))
+    owners = {
+        match_id: [puuid for puuid in puuids if (puuid, match_id) not in stored]
+        for match_id, puuids in owners.items()
+    }
+    owners = {match_id: puuids for match_id, puuids in owners.items() if puuids}
+
+    # Matches already stored for another summoner are copied, only the others are fetched from Riot
+    matches = await load_stored_matches(list(owners))
+    to_fetch = [match_id for match_id in owners if match_id not in matches]
+    if call_budget is not None:
+        # Listing a summoner's match ids is counted as a single call
+        to_fetch = to_fetch[:max(call_budget - len(summoners), 0)]
+
+    async def fetch(match_id):
+        async with semaphore:
+            return match_id, await fetch_match(match_id, summoners[owners[match_id][0]])
+
+    for match_id, match in await asyncio.gather(*(fetch(match_id) for match_id in to_fetch)):
+        if match:
+            matches[match_id] = match
+        else:
+            metrics.incr("ingestion.fetch_failures")
+
+    buffer_matches(list(matches.values()), owners)
+
+    # Advance the high-water mark of the summoners whose new matches were all stored
+    # and bump the data version (matches_updated_at) of the summoners with new matches, see summoner_data_versions()
+    # Written by match_writer after the matches, in the same flush
+    high_water_mark = int((listed_at - IN_PROGRESS_GRACE).timestamp())
+    updated = [
+        puuid
+        for puuid, match_ids in match_ids_by_summoner.items()
+        if all(match_id in matches or match_id not in owners for match_id in match_ids)
+    ]
+    new_matches = {puuid for match_id in matches for puuid in owners[match_id]}
+    timestamp_updates = []
+    for puuid in updated:
+        update = {"$max": {"start_time": high_water_mark}, "$set": {"last_ingested": listed_at}}
+        if puuid in new_matches:
+            update["$set"]["matches_updated_at"] = listed_at
+        timestamp_updates.append(UpdateOne({"puuid": puuid}, update, upsert=True))
+    for puuid in new_matches.difference(updated):
+        timestamp_updates.append(UpdateOne({"puuid": puuid}, {"$set": {"matches_updated_at": listed_at}}))
+    match_writer.add("cached_match_data_timestamps", timestamp_updates)
+    match_writer.after_flush(lambda: _mark_cached(updated))
+    await match_writer.flush_if_full()
+
+    results = {puuid: None for puuid in summoner_puuids}
+    for puuid in updated:
+        results[puuid] = sum(
+            1 for match_id in match_ids_by_summoner[puuid] if match_id in matches and puuid in owners[match_id]
+        )
+
+    if STATS_ENGINE == "rollup" and new_matches:
+        # Rollups are refreshed from the stored matches
+        await match_writer.flush()
+        await refresh_rollups(list(new_matches))
+
+    elapsed = time.perf_counter() - started
+    metrics.incr("ingestion.cycles")
+    metrics.incr("ingestion.matches_listed", sum(len(match_ids) for match_ids in match_ids_by_summoner.values()))
+    metrics.incr("ingestion.matches_fetched", len(to_fetch))
+    riot_calls = len(summoners) + len(to_fetch)
+    metrics.incr("ingestion.riot_calls", riot_calls)
+    if call_budget:
+        metrics.gauge("ingestion.budget_used", round(riot_calls / call_budget, 2))
+    metrics.incr("ingestion.matches_stored", len(matches))
+    metrics.observe("ingestion.cycle_seconds", elapsed)
+
+    summary = {
+        "summoners": len(summoner_puuids),
+        "unresolved_regions": len(summoner_puuids) - len(summoners),
+        "listing_failures": len(summoners) - len(match_ids_by_summoner),
+        "new_matches": len(owners),
+        "fetched": len(to_fetch),
+        "stored": len(matches),
+        "up_to_date": len(updated),
+        "seconds": round(elapsed, 2),
+    }
+    print(f"Ingestion cycle finished: {summary}")
+    summary["results"] = results
+    return summary
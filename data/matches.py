@@ -0,0 +1,317 @@
+from datetime import datetime, timezone
+from numbers import Number
+from pymongo import UpdateOne
+
+from config import MATCH_STORAGE, MATCH_WRITE_BATCH_SIZE, MATCH_WRITE_MAX_DELAY_SECONDS
+from data.bulk_writer import BulkWriter
+from data.database import db
+from data.pipelines import guild_matches_pipeline, slice_stats_pipeline, summoner_matches_pipeline, summoner_stats_pipeline
+from utils.stats import FIELD_STATS, STATS_FINGERPRINT, build_participant_index, find_participant
+
+# Match storage, every read of stored matches for stats goes through this module
+# Legacy format: cached_match_data holds the full match payload once per tracked summoner (summoner_puuid)
+# Normalized format:
+#   matches: one canonical document per match, _id is the match id
+#   match_slices: one compact document per (summoner, match) holding only the summoner's stat fields as numbers
+#       puuid, match_id, game_start and participant, shaped like a pruned participant entry
+#   match_slice_state: summoners whose matches were copied into match_slices, _id is the puuid
+#       fingerprint: the STATS_FINGERPRINT of the fields their slices hold
+# MATCH_STORAGE selects where stats are read from
+#   "legacy": cached_match_data only
+#   "dual": match_slices for summoners already migrated, cached_match_data for the others
+#   "slices": match_slices only
+# Slices only hold the stat fields of when they were written, after the stats change a summoner's slices are
+# read from cached_match_data again ("dual") or rewritten from the canonical matches before being read ("slices")
+
+# Buffered writes of ingested matches, and of the ingestion high-water marks written after them
+match_writer = BulkWriter(
+    "match_writer",
+    ["cached_match_data", "matches", "match_slices", "cached_match_data_timestamps"],
+    MATCH_WRITE_BATCH_SIZE,
+    MATCH_WRITE_MAX_DELAY_SECONDS,
+)
+
+
+# Returns a stat field's value as a number, true counts as 1 like in the stats engines
+def _numeric(stat, participant):
+    value = stat.read(participant)
+    if isinstance(value, bool):
+        return int(value)
+    return value if isinstance(value, Number) else stat.default
+
+
+# Builds the compact slice of a summoner's participant entry in a match
+def build_match_slice(match, summoner_puuid):
+    participant = find_participant(match, summoner_puuid)
+    if participant is None:
+        return None
+
+    compact = {"puuid": summoner_puuid}
+    for stat in FIELD_STATS:
+        if stat.source == "challenges":
+            compact.setdefault("challenges", {})[stat.field] = _numeric(stat, participant)
+        else:
+            compact[stat.field] = _numeric(stat, participant)
+
+    return {
+        "puuid": summoner_puuid,
+        "match_id": match["metadata"]["matchId"],
+        "game_start": match["info"]["gameStartTimestamp"],
+        "participant": compact,
+    }
+
+
+# Builds the upsert storing a match's canonical document, a match already stored is left untouched
+def canonical_match_update(match):
+    return UpdateOne(
+        {"_id": match["metadata"]["matchId"]},
+        {
+            "$setOnInsert": {
+                "metadata": match["metadata"],
+                "info": match["info"],
+                "participant_index": build_participant_index(match),
+            }
+        },
+        upsert=True,
+    )
+
+
+# Builds the upsert storing a summoner's slice of a match, None if the summoner did not play in it
+# The generated _id grows with insertion time like the one of cached_match_data, rollup watermarks rely on it
+# With overwrite, a slice already stored is rewritten instead of being left untouched
+def match_slice_update(match, summoner_puuid, overwrite=False):
+    match_slice = build_match_slice(match, summoner_puuid)
+    if match_slice is None:
+        return None
+
+    # puuid and match_id come from the filter
+    return UpdateOne(
+        {"puuid": summoner_puuid, "match_id": match_slice["match_id"]},
+        {
+            "$set" if overwrite else "$setOnInsert": {
+                "game_start": match_slice["game_start"],
+                "participant": match_slice["participant"],
+            }
+        },
+        upsert=True,
+    )
+
+
+# Builds the upsert storing a match in cached_match_data for one of the summoners it is tracked for
+# The metadata fields are set one by one, metadata.matchId comes from the filter
+def legacy_match_update(match, summoner_puuid):
+    metadata = {
+        f"metadata.{key}": value for key, value in match["metadata"].items() if key != "matchId"
+    }
+    return UpdateOne(
+        {"summoner_puuid": summoner_puuid, "metadata.matchId": match["metadata"]["matchId"]},
+        {
+            "$setOnInsert": {
+                **metadata,
+                "info": match["info"],
+                "participant_index": build_participant_index(match),
+            }
+        },
+        upsert=True,
+    )
+
+
+# Buffers matches in match_writer for the summoners they were fetched for, in every format MATCH_STORAGE reads
+# owners maps each match id to the summoners to store it for
+def buffer_matches(matches, owners):
+    legacy_updates = []
+    canonical_updates = []
+    slice_updates = []
+    for match in matches:
+        match_owners = owners[match["metadata"]["matchId"]]
+        if MATCH_STORAGE != "slices":
+            legacy_updates.extend(legacy_match_update(match, owner) for owner in match_owners)
+        if MATCH_STORAGE != "legacy":
+            canonical_updates.append(canonical_match_update(match))
+            for owner in match_owners:
+                slice_update = match_slice_update(match, owner)
+                if slice_update is not None:
+                    slice_updates.append(slice_update)
+
+    match_writer.add("cached_match_data", legacy_updates)
+    match_writer.add("matches", canonical_updates)
+    match_writer.add("match_slices", slice_updates)
+
+
+# Returns the (puuid, match id) pairs out of the given summoners and matches that are already stored
+async def stored_match_pairs(summoner_puuids, match_ids):
+    if not summoner_puuids or not match_ids:
+        return set()
+
+    if MATCH_STORAGE == "slices":
+        documents = await db.match_slices.find(
+            {"puuid": {"$in": summoner_puuids}, "match_id": {"$in": match_ids}},
+            {"_id": 0, "puuid": 1, "match_id": 1},
+        ).to_list(length=None)
+        return {(document["puuid"], document["match_id"]) for document in documents}
+
+    documents = await db.cached_match_data.find(
+        {"summoner_puuid": {"$in": summoner_puuids}, "metadata.matchId": {"$in": match_ids}},
+        {"_id": 0, "summoner_puuid": 1, "metadata.matchId": 1},
+    ).to_list(length=None)
+    return {(document["summoner_puuid"], document["metadata"]["matchId"]) for document in documents}
+
+
+# Returns the full payloads of the given matches that are already stored for any summoner, keyed by match id
+# Lets a match shared with a summoner tracked earlier be stored again without calling the Riot API
+async def load_stored_matches(match_ids):
+    if not match_ids:
+        return {}
+
+    matches = {}
+    if MATCH_STORAGE != "legacy":
+        cursor = db.matches.find({"_id": {"$in": match_ids}}, {"_id": 0, "metadata": 1, "info": 1})
+        async for match in cursor:
+            matches[match["metadata"]["matchId"]] = match
+
+    missing = [match_id for match_id in match_ids if match_id not in matches]
+    if MATCH_STORAGE != "slices" and missing:
+        cursor = db.cached_match_data.find(
+            {"metadata.matchId": {"$in": missing}}, {"_id": 0, "metadata": 1, "info": 1}
+        )
+        async for match in cursor:
+            matches.setdefault(match["metadata"]["matchId"], match)
+    return matches
+
+
+# Summoners whose slices this process found to hold the current stat fields
+# Slices written from now on hold them as well, so a summoner is only checked once
+_current_slices = set()
+
+
+# Marks summoners whose matches are all stored in match_slices with the current stat fields,
+# "dual" reads switch to the slices for them
+async def mark_sliced(summoner_puuids):
+    if summoner_puuids:
+        await db.match_slice_state.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": puuid},
+                    {"$set": {"migrated_at": datetime.now(timezone.utc), "fingerprint": STATS_FINGERPRINT}},
+                    upsert=True,
+                )
+                for puuid in summoner_puuids
+            ],
+            ordered=False,
+        )
+        _current_slices.update(summoner_puuids)
+
+
+# Rewrites every slice of the given summoners from the canonical matches, then marks them sliced
+# Used when the slices were written for other stat definitions and lack fields the stats read
+async def reslice_summoners(summoner_puuids, batch_size=500):
+    for summoner_puuid in summoner_puuids:
+        match_ids = await db.match_slices.distinct("match_id", {"puuid": summoner_puuid})
+        for start in range(0, len(match_ids), batch_size):
+            cursor = db.matches.find({"_id": {"$in": match_ids[start:start + batch_size]}})
+            updates = [match_slice_update(match, summoner_puuid, overwrite=True) async for match in cursor]
+            updates = [update for update in updates if update is not None]
+            if updates:
+                await db.match_slices.bulk_write(updates, ordered=False)
+        print(f"Rewrote {len(match_ids)} match slices of {summoner_puuid} for the current stats.")
+
+    await mark_sliced(summoner_puuids)
+
+
+# Returns the summoners, out of summoner_puuids, whose matches are read from match_slices
+# Only summoners whose slices hold the current stat fields are read from them in "dual",
+# with "slices" the other summoners' slices are rewritten first
+async def sliced_summoners(summoner_puuids):
+    if MATCH_STORAGE not in ("dual", "slices"):
+        return set()
+
+    unchecked = [puuid for puuid in summoner_puuids if puuid not in _current_slices]
+    if unchecked:
+        states = await db.match_slice_state.find(
+            {"_id": {"$in": unchecked}, "fingerprint": STATS_FINGERPRINT}, {"_id": 1}
+        ).to_list(length=None)
+        _current_slices.update(state["_id"] for state in states)
+
+        outdated = [puuid for puuid in unchecked if puuid not in _current_slices]
+        if MATCH_STORAGE == "slices" and outdated:
+            await reslice_summoners(outdated)
+
+    if MATCH_STORAGE == "slices":
+        return set(summoner_puuids)
+    return {puuid for puuid in summoner_puuids if puuid in _current_slices}
+
+
+def _slice_query(summoner_puuids, lower_range_epoch, upper_range_epoch=None, inserted_after=None):
+    query = {"puuid": {"$in": summoner_puuids}}
+    game_start = {}
+    if lower_range_epoch is not None:
+        game_start["$gte"] = lower_range_epoch
+    if upper_range_epoch is not None:
+        game_start["$lt"] = upper_range_epoch
+    if game_start:
+        query["game_start"] = game_start
+    if inserted_after is not None:
+        query["_id"] = {"$gt": inserted_after}
+    return query
+
+
+# Returns a summoner's matches started after lower_range_epoch, pruned to the summoner's own participant entry
+# Same shape from both formats: {"metadata": {"matchId"}, "info": {"gameStartTimestamp", "participants": [participant]}}
+async def read_summoner_matches(summoner_puuid, lower_range_epoch):
+    if summoner_puuid not in await sliced_summoners([summoner_puuid]):
+        pipeline = summoner_matches_pipeline(summoner_puuid, lower_range_epoch)
+        return await db.cached_match_data.aggregate(pipeline).to_list(length=None)
+
+    slices = await db.match_slices.find(
+        _slice_query([summoner_puuid], lower_range_epoch), {"_id": 0, "puuid": 0}
+    ).to_list(length=None)
+    return [
+        {
+            "metadata": {"matchId": match_slice["match_id"]},
+            "info": {
+                "gameStartTimestamp": match_slice["game_start"],
+                "participants": [match_slice["participant"]],
+            },
+        }
+        for match_slice in slices
+    ]
+
+
+# Returns a summoner's stat totals for matches started after lower_range_epoch, calculated inside MongoDB
+# A single document with the number of matches and one running total per stat, None without matches
+async def read_summoner_stat_totals(summoner_puuid, lower_range_epoch):
+    if summoner_puuid in await sliced_summoners([summoner_puuid]):
+        pipeline = slice_stats_pipeline(summoner_puuid, lower_range_epoch)
+        results = await db.match_slices.aggregate(pipeline).to_list(length=1)
+    else:
+        pipeline = summoner_stats_pipeline(summoner_puuid, lower_range_epoch)
+        results = await db.cached_match_data.aggregate(pipeline).to_list(length=1)
+    return results[0] if results else None
+
+
+# Returns the matches of a group of summoners, in the shape of guild_matches_pipeline's output
+# Arguments are the same as guild_matches_pipeline's
+# Slices are not merged by match id, each one is returned as a match owned by its summoner only
+async def read_guild_matches(summoner_puuids, lower_range_epoch, upper_range_epoch=None, inserted_after=None):
+    sliced = await sliced_summoners(summoner_puuids)
+    legacy = [puuid for puuid in summoner_puuids if puuid not in sliced]
+
+    matches = []
+    if legacy:
+        pipeline = guild_matches_pipeline(legacy, lower_range_epoch, upper_range_epoch, inserted_after)
+        matches = await db.cached_match_data.aggregate(pipeline).to_list(length=None)
+
+    if sliced:
+        query = _slice_query(list(sliced), lower_range_epoch, upper_range_epoch, inserted_after)
+        async for match_slice in db.match_slices.find(query):
+            matches.append(
+                {
+                    "_id": match_slice["match_id"],
+                    "owners": [match_slice["puuid"]],
+                    "game_start": match_slice["game_start"],
+                    "last_id": match_slice["_id"],
+                    "participants": [match_slice["participant"]],
+                }
+            )
+
+    return matches
@@ -0,0 +1,105 @@
+from pymongo import UpdateOne
+
+from data.database import db
+from data.matches import canonical_match_update, mark_sliced, match_slice_update
+from data.pipelines import summoner_matches_pipeline
+from utils.stats import STATS_FINGERPRINT, build_participant_index, calculate
+
+# One-off data migrations, none of them get called anywhere, mainly for admin use
+# Each one only touches documents that were not migrated yet, so it can be stopped and run again
+
+
+# Stores the participant_index ({puuid: position}) on every cached match document missing it
+# Only the participants' puuids are read and the updates are written in batches of batch_size
+async def migrate_participant_index(batch_size=1000):
+    cursor = db.cached_match_data.find(
+        {"participant_index": {"$exists": False}}, {"info.participants.puuid": 1}
+    )
+
+    migrated = 0
+    updates = []
+    async for match in cursor:
+        updates.append(
+            UpdateOne(
+                {"_id": match["_id"]},
+                {"$set": {"participant_index": build_participant_index(match)}},
+            )
+        )
+        if len(updates) >= batch_size:
+            await db.cached_match_data.bulk_write(updates, ordered=False)
+            migrated += len(updates)
+            updates = []
+            print(f"Stored participant_index on {migrated} cached matches...")
+
+    if updates:
+        await db.cached_match_data.bulk_write(updates, ordered=False)
+        migrated += len(updates)
+
+    print(f"Finished storing participant_index on {migrated} cached matches.")
+    return migrated
+
+
+# Copies cached_match_data into the normalized format: one canonical document per match in matches
+# and one compact slice per (summoner, match) in match_slices
+# Summoners are migrated one at a time and marked in match_slice_state once all their matches are copied,
+# with MATCH_STORAGE "dual" their stats are read from the slices from then on
+# Summoners migrated for other stat definitions are migrated again, rewriting their slices
+async def migrate_match_slices(batch_size=500):
+    summoner_puuids = await db.cached_match_data.distinct("summoner_puuid")
+    migrated = set(await db.match_slice_state.distinct("_id", {"fingerprint": STATS_FINGERPRINT}))
+    pending = [puuid for puuid in summoner_puuids if puuid not in migrated]
+
+    for summoner_puuid in pending:
+        matches = 0
+        canonical_updates = []
+        slice_updates = []
+        async for match in db.cached_match_data.find({"summoner_puuid": summoner_puuid}):
+            matches += 1
+            canonical_updates.append(canonical_match_update(match))
+            slice_update = match_slice_update(match, summoner_puuid, overwrite=True)
+            if slice_update is not None:
+                slice_updates.append(slice_update)
+
+            if len(canonical_updates) >= batch_size:
+                await _write_match_batch(canonical_updates, slice_updates)
+                canonical_updates, slice_updates = [], []
+
+        await _write_match_batch(canonical_updates, slice_updates)
+        await mark_sliced([summoner_puuid])
+        print(f"Migrated {matches} cached matches of {summoner_puuid} to match slices.")
+
+    print(f"Finished migrating {len(pending)} summoners to match slices.")
+    return len(pending)
+
+
+async def _write_match_batch(canonical_updates, slice_updates):
+    if canonical_updates:
+        await db.matches.bulk_write(canonical_updates, ordered=False)
+    if slice_updates:
+        await db.match_slices.bulk_write(slice_updates, ordered=False)
+
+
+# Compares a summoner's stats calculated from cached_match_data and from match_slices
+# Meant for the dual read period, before switching MATCH_STORAGE to "slices". Returns True when both agree
+async def check_match_slices(summoner_puuid, lower_range_epoch=0):
+    pipeline = summoner_matches_pipeline(summoner_puuid, lower_range_epoch)
+    legacy_matches = await db.cached_match_data.aggregate(pipeline).to_list(length=None)
+    slices = await db.match_slices.find(
+        {"puuid": summoner_puuid, "game_start": {"$gte": lower_range_epoch}}
+    ).to_list(length=None)
+
+    legacy_stats = calculate(summoner_puuid, legacy_matches)
+    slice_stats = calculate(
+        summoner_puuid,
+        [{"info": {"participants": [match_slice["participant"]]}} for match_slice in slices],
+    )
+
+    mismatches = {
+        key: (legacy_stats[key], slice_stats[key])
+        for key in legacy_stats
+        if legacy_stats[key] != slice_stats[key]
+    }
+    for key, (legacy_value, slice_value) in mismatches.items():
+        print(f"Match slice mismatch for {summoner_puuid} on {key}: legacy={legacy_value}, slices={slice_value}")
+
+    return not mismatches
@@ -1,39 +1,76 @@
-import os
-from pymongo import MongoClient
-from dotenv import load_dotenv
-import certifi
 from datetime import datetime, timedelta, timezone
 from bson.objectid import ObjectId
 
-from utils.stats import calculate
-from data.riot import fetch_summoner_puuid_by_riot_id, get_summoner_region
-
-# Load environment variables from .env file
-load_dotenv()
-ca = certifi.where()
-
-
-client = MongoClient(os.getenv("MONGO_DB_URI"), tlsCAFile=ca)
-db = client["league_discord_bot"]
+from config import (
+    GUILD_CACHE_SIZE,
+    GUILD_CACHE_TTL,
+    RESOLUTION_CACHE_SIZE,
+    RESOLUTION_CACHE_TTL,
+    RESOLUTION_NEGATIVE_TTL,
+    REGION_CACHE_TTL,
+    STATS_ENGINE,
+)
+from data.database import db
+from utils.cache import LRUCache
+import utils.metrics as metrics
+from utils.scheduler import PRIORITY_NEW
+from utils.singleflight import SingleFlight
+from utils.stats import (
+    FIELD_STATS,
+    MATCHES_LABEL,
+    STATS_FINGERPRINT,
+    calculate,
+    calculate_participants_batch,
+    calculate_vectorized,
+    empty_stats,
+    finalize,
+    sum_participants,
+)
+from data.riot import lookup_summoner_puuid_by_riot_id, lookup_summoner_region, get_summoner_region
+from data.ingestion import bump_summoner, get_cached_summoners, summoner_data_versions
+from data.rollups import rollup_guild_stats
+from data.result_cache import cached_result, result_key
+from data.matches import read_guild_matches, read_summoner_matches, read_summoner_stat_totals
+from data.pipelines import group_participants_by_owner
+
+# In-memory layer of the summoner resolution cache (riot id -> puuid, puuid -> region)
+# Backed by the summoner_resolution_cache collection so entries survive restarts and are shared between shards
+resolution_cache = LRUCache(maxsize=RESOLUTION_CACHE_SIZE)
+_MISS = object()
+
+# Coalesces identical in-flight match range queries, keyed by (puuid, range)
+match_data_flight = SingleFlight("mongo.match_data.singleflight")
+
+# In-memory cache of guild configurations (name, summoners, main channel), keyed by guild id
+# Every write to a guild below invalidates its entry, the TTL bounds how stale a change made by another process can get
+# unless the change stream listener (watch_guild_changes) runs
+guild_cache = LRUCache(maxsize=GUILD_CACHE_SIZE, ttl=GUILD_CACHE_TTL)
+guild_flight = SingleFlight("mongo.guild.singleflight")
+GUILD_PROJECTION = {"_id": 0, "guild_id": 1, "name": 1, "summoners": 1, "main_channel_id": 1}
+# Number of guild invalidations so far, a guild read while one happened is not cached as it may be stale
+_guild_invalidations = 0
 
 
 # Adds a summoner to a Guild
 async def add_summoner(summoner_riot_id, guild_id):
     # check if riot user exists before inserting into db
-    puuid = await fetch_summoner_puuid_by_riot_id(summoner_riot_id)
+    puuid = await resolve_summoner_puuid(summoner_riot_id)
     if puuid:
-        region = await get_summoner_region(puuid)
+        region = await resolve_summoner_region(puuid)
         collection = db.discord_servers
         # Update or insert  summoner riot id into the summoners array for the corresponding discord server
-        result = collection.update_one(
+        result = await collection.update_one(
             {"guild_id": guild_id},
             {"$addToSet": {"summoners": {"name": summoner_riot_id, "puuid": puuid, "region": region}}},
             upsert=True,  # Creates a new document if one doesn't exist
         )
+        invalidate_guild(guild_id)
         if result.acknowledged:
             print(
                 f"Document for summoner '{summoner_riot_id}' was successfully added to Guild with id {guild_id}"
             )
+            # Fetch the new summoner's matches at the next ingestion tick
+            bump_summoner(puuid, PRIORITY_NEW, region)
             return True
         else:
             print(
@@ -45,14 +82,94 @@ async def add_summoner(summoner_riot_id, guild_id):
     return False
 
 
+# Resolves a riot id to a puuid, only calling the Riot API when no cache layer knows the answer
+# Order: in-memory cache, guild summoner lists, resolution cache collection, Riot API
+# Accounts that do not exist are cached negatively for a short time
+async def resolve_summoner_puuid(summoner_riot_id):
+    key = f"riot_id:{summoner_riot_id.strip().lower()}"
+    puuid = await _get_resolution(key)
+    if puuid is not _MISS:
+        return puuid
+
+    # Guilds already store the riot id -> puuid mapping for every summoner they track
+    document = await db.discord_servers.find_one(
+        {"summoners.name": summoner_riot_id}, {"summoners.$": 1}
+    )
+    if document:
+        summoner = document["summoners"][0]
+        await _set_resolution(key, summoner["puuid"], RESOLUTION_CACHE_TTL)
+        if summoner.get("region"):
+            resolution_cache.set(f"region:{summoner["puuid"]}", summoner["region"], ttl=REGION_CACHE_TTL)
+        return summoner["puuid"]
+
+    puuid, found = await lookup_summoner_puuid_by_riot_id(summoner_riot_id)
+    if puuid:
+        await _set_resolution(key, puuid, RESOLUTION_CACHE_TTL)
+    elif found is False:
+        await _set_resolution(key, None, RESOLUTION_NEGATIVE_TTL)
+    return puuid
+
+
+# Resolves the region a summoner plays on, only calling the Riot API when no cache layer knows the answer
+# Summoners no platform knows are cached negatively for a short time, failed lookups are not cached
+async def resolve_summoner_region(summoner_puuid):
+    key = f"region:{summoner_puuid}"
+    region = await _get_resolution(key)
+    if region is not _MISS:
+        return region
+
+    document = await db.discord_servers.find_one(
+        {"summoners": {"$elemMatch": {"puuid": summoner_puuid, "region": {"$ne": None}}}},
+        {"summoners.$": 1},
+    )
+    if document:
+        region = document["summoners"][0]["region"]
+        await _set_resolution(key, region, REGION_CACHE_TTL)
+        return region
+
+    region, found = await lookup_summoner_region(summoner_puuid)
+    if region:
+        await _set_resolution(key, region, REGION_CACHE_TTL)
+    elif found is False:
+        await _set_resolution(key, None, RESOLUTION_NEGATIVE_TTL)
+    return region
+
+
+# Returns a resolution cache entry from memory or the database, or _MISS if neither has a live entry
+async def _get_resolution(key):
+    value = resolution_cache.get(key, _MISS)
+    if value is not _MISS:
+        return value
+
+    now = datetime.now(timezone.utc)
+    document = await db.summoner_resolution_cache.find_one({"_id": key, "expires_at": {"$gt": now}})
+    if document:
+        expires_at = document["expires_at"].replace(tzinfo=timezone.utc)
+        resolution_cache.set(key, document["value"], ttl=(expires_at - now).total_seconds())
+        return document["value"]
+
+    return _MISS
+
+
+# Stores a resolution cache entry in memory and in the database
+async def _set_resolution(key, value, ttl):
+    resolution_cache.set(key, value, ttl=ttl)
+    await db.summoner_resolution_cache.update_one(
+        {"_id": key},
+        {"$set": {"value": value, "expires_at": datetime.now(timezone.utc) + timedelta(seconds=ttl)}},
+        upsert=True,
+    )
+
+
 # Removes a summoner from a Guild
 async def remove_summoner(summoner_riot_id, guild_id):
     collection = db.discord_servers
     # Remove summoner from the summoners array for the corresponding discord server
-    result = collection.update_one(
+    result = await collection.update_one(
         {"guild_id": guild_id},
         {"$pull": {"summoners": {"name": summoner_riot_id}}},
     )
+    invalidate_guild(guild_id)
     if result.acknowledged:
         print(
             f"Document for summoner '{summoner_riot_id}' was successfully removed from Guild with id {guild_id}"
@@ -65,10 +182,56 @@ async def remove_summoner(summoner_riot_id, guild_id):
     return False
 
 
+# Returns a Guild's configuration (guild_id, name, summoners, main_channel_id), None if the guild is not stored
+# Served from guild_cache, the returned document is shared and must not be modified
+async def get_guild_config(guild_id):
+    guild = guild_cache.get(guild_id, _MISS)
+    if guild is not _MISS:
+        metrics.incr("mongo.guild_cache.hits")
+        return guild
+
+    metrics.incr("mongo.guild_cache.misses")
+    return await guild_flight.do(guild_id, _load_guild_config, guild_id)
+
+
+async def _load_guild_config(guild_id):
+    invalidations = _guild_invalidations
+    guild = await db.discord_servers.find_one({"guild_id": guild_id}, GUILD_PROJECTION)
+    if invalidations == _guild_invalidations:
+        guild_cache.set(guild_id, guild)
+    return guild
+
+
+# Drops a Guild's cached configuration, called after every write to the guild
+def invalidate_guild(guild_id):
+    global _guild_invalidations
+    _guild_invalidations += 1
+    guild_cache.pop(guild_id)
+
+
+# Keeps guild_cache coherent with writes made by other bot processes, through a MongoDB change stream
+# Needs a replica set, stops with a message when change streams are not available and the TTL takes over
+async def watch_guild_changes():
+    global _guild_invalidations
+    pipeline = [{"$project": {"operationType": 1, "fullDocument.guild_id": 1}}]
+    try:
+        async with db.discord_servers.watch(pipeline, full_document="updateLookup") as stream:
+            print("Watching guild configuration changes.")
+            async for change in stream:
+                guild_id = (change.get("fullDocument") or {}).get("guild_id")
+                if guild_id is None:
+                    # Deleted documents only carry their _id, drop every entry
+                    _guild_invalidations += 1
+                    guild_cache.clear()
+                else:
+                    invalidate_guild(guild_id)
+    except Exception as e:
+        print(f"Stopped watching guild configuration changes: {e}")
+
+
 # Returns a list of all summoners within a Guild (discord server)
 async def get_summoners(guild_id):
-    collection = db.discord_servers
-    document = collection.find_one({"guild_id": guild_id})
+    document = await get_guild_config(guild_id)
 
     if document and "summoners" in document:
         summoners_list = document["summoners"]
@@ -81,13 +244,14 @@ async def get_summoners(guild_id):
 async def add_guild(guild_name, guild_id):
     collection = db.discord_servers
 
-    if collection.count_documents({"guild_id": guild_id}) == 0:
+    if await collection.count_documents({"guild_id": guild_id}) == 0:
         document = {
             "name": guild_name,
             "guild_id": guild_id,
             "date_added": datetime.now(),
         }
-        result = collection.insert_one(document)
+        result = await collection.insert_one(document)
+        invalidate_guild(guild_id)
         if result.acknowledged:
             print(
                 f"Document for guild '{guild_name}' was successfully inserted into MongoDB with _id: {result.inserted_id}"
@@ -102,11 +266,12 @@ async def add_guild(guild_name, guild_id):
 # The main channel is where automatic messages will be sent
 async def set_main_channel(guild_id, channel_id):
     collection = db.discord_servers
-    result = collection.update_one(
+    result = await collection.update_one(
         {"guild_id": guild_id},
         {"$set": {"main_channel_id": channel_id}},
         upsert=True,  # Creates a new document if one doesn't exist
     )
+    invalidate_guild(guild_id)
 
     # Check if the document was updated
     if result.modified_count > 0:
@@ -121,8 +286,7 @@ async def set_main_channel(guild_id, channel_id):
 
 # Returns the main_channel_id for a Guild
 async def get_main_channel(guild_id):
-    collection = db.discord_servers
-    document = collection.find_one({"guild_id": guild_id})
+    document = await get_guild_config(guild_id)
 
     if document:
         main_channel_id = document.get("main_channel_id", None)
@@ -132,62 +296,65 @@ async def get_main_channel(guild_id):
 
 
 # Fetches a summoner's stats for all matches played in the last {range} days
-async def fetch_summoner_stats_by_day_range(summoner_puuid, range=7):
-    print(f"Fetching {range} day stats for {summoner_puuid}...")
-    matches_data = await fetch_all_summoner_match_data_by_range(summoner_puuid, range)
-    stats = calculate(summoner_puuid, matches_data)
+# engine selects where the stats are calculated, defaults to the STATS_ENGINE setting:
+#   "python": matches are read and calculated in Python
+#   "mongo": matches are aggregated by MongoDB, only the totals come back
+#   "rollup": whole days are merged from the daily rollups, only the partial first day is read raw
+#   "numpy": matches are read like the python engine and calculated with the vectorized engine
+async def fetch_summoner_stats_by_day_range(summoner_puuid, range=7, engine=None):
+    engine = engine or STATS_ENGINE
+    # Cached until new matches are ingested for the summoner, see data.result_cache
+    versions = await summoner_data_versions([summoner_puuid])
+    key = result_key("stats", summoner_puuid, range, engine, STATS_FINGERPRINT, versions[summoner_puuid])
+    return await cached_result(key, lambda: _fetch_summoner_stats_by_day_range(summoner_puuid, range, engine))
+
+
+async def _fetch_summoner_stats_by_day_range(summoner_puuid, range, engine):
+    print(f"Fetching {range} day stats for {summoner_puuid} ({engine} engine)...")
+
+    if engine == "python":
+        matches_data = await fetch_all_summoner_match_data_by_range(summoner_puuid, range)
+        stats = calculate(summoner_puuid, matches_data)
+    elif engine == "mongo":
+        stats = await aggregate_summoner_stats_by_range(summoner_puuid, range)
+    elif engine == "rollup":
+        summoners_stats = await rollup_guild_stats([summoner_puuid], _lower_range_epoch(range))
+        stats = summoners_stats[summoner_puuid]
+    elif engine == "numpy":
+        matches_data = await fetch_all_summoner_match_data_by_range(summoner_puuid, range)
+        stats = calculate_vectorized(summoner_puuid, matches_data)
+    else:
+        raise ValueError(f"Unknown stats engine '{engine}'.")
     return stats
 
 
+# Calculates a summoner's stats for the last {range} days with an aggregation pipeline
+# Returns the same dictionary as calculate()
+async def aggregate_summoner_stats_by_range(summoner_puuid, range=7):
+    result = await read_summoner_stat_totals(summoner_puuid, _lower_range_epoch(range))
+
+    totals = empty_stats()
+    if result:
+        totals[MATCHES_LABEL] = result["matches"]
+        for stat in FIELD_STATS:
+            totals[stat.label] = result[stat.name]
+    else:
+        print(
+            f"No summoner match data found for {summoner_puuid} within the last {range} days."
+        )
+    return finalize(totals)
+
+
 # Fetches weekly report for a Guild within certain range
 # The report will display which summoner has the highest value for each stat
 async def fetch_report_by_day_range(guild_id, range=7):
-    guild_data = db.discord_servers.find_one({"guild_id": guild_id})
-    guild_name = guild_data.get("name", "None")
-    print(f"Fetching {range} day report for Guild: {guild_name}...")
+    guild_data = await get_guild_config(guild_id)
     if guild_data:
-        agg_stats = []
-        summoners = await get_summoners(guild_id)
+        guild_name = guild_data.get("name", "None")
+        summoners = guild_data.get("summoners")
 
         if summoners:
-            for summoner in summoners:
-                puuid = summoner["puuid"]
-                matches_data = await fetch_all_summoner_match_data_by_range(
-                    summoner_puuid=puuid, range=range
-                )
-                stats = calculate(
-                    summoner_puuid=puuid, matches_data=matches_data
-                )
-                weekly_stats_with_name = stats.copy()
-                weekly_stats_with_name["Name"] = summoner["name"]
-                agg_stats.append(weekly_stats_with_name)
-
-            # Extract keys excluding 'Name'
-            keys = [key for key in agg_stats[0] if key != "Name"]
-
-            # Initialize a dictionary to store max values and corresponding names
-            max_values = {key: {"value": float("-inf"), "Name": None} for key in keys}
-
-            # Update max_values with the max value for each key and corresponding name
-            for item in agg_stats:
-                for key in keys:
-                    if item[key] > max_values[key]["value"]:
-                        max_values[key] = {"value": item[key], "Name": item["Name"]}
-
-            # Convert the result into a list of dictionaries as specified
-            result = [
-                {
-                    "Key": key,
-                    "Max Value": max_values[key]["value"],
-                    "Name": max_values[key]["Name"],
-                }
-                for key in max_values
-            ]
-
-            print(
-                f"Finished fetching weekly report for Guild: {guild_name}. Compared stats of {len(summoners)} summoners."
-            )
-            return result
+            return await build_report_by_day_range(summoners, range, guild_name)
         else:
             print(f"No summoners found for guild with id {guild_id}.")
             return None
@@ -195,32 +362,116 @@ async def fetch_report_by_day_range(guild_id, range=7):
         print(f"Guild {guild_id} does not exist in the database")
 
 
-# Fetches all matches stored in database for summoner within a range
-async def fetch_all_summoner_match_data_by_range(summoner_puuid, range=7):
-    print(f"Fetching all matches for {summoner_puuid} within the last {range} days")
-    collection = db.cached_match_data
+# Builds the report of a Guild's summoners (as stored on the guild) within certain range
+# Lets callers that already loaded the guild's summoners skip reading the guild again
+# Cached until the guild's summoners change or new matches are ingested for any of them, see data.result_cache
+# key is the report's report_key(), looked up when not given
+async def build_report_by_day_range(summoners, range=7, guild_name="None", key=None):
+    key = key or await report_key(summoners, range)
+    return await cached_result(key, lambda: _build_report_by_day_range(summoners, range, guild_name))
+
+
+# Returns the key identifying a report of these summoners for the range
+# It changes whenever the summoners change or new matches are ingested for any of them
+async def report_key(summoners, range=7):
+    versions = await summoner_data_versions([summoner["puuid"] for summoner in summoners])
+    members = [(summoner["name"], summoner["puuid"], versions[summoner["puuid"]]) for summoner in summoners]
+    return result_key("report", range, STATS_ENGINE, STATS_FINGERPRINT, members)
 
-    now = datetime.now(timezone.utc)
-    lower_range = now - timedelta(days=range)
-    lower_range_epoch = int(lower_range.timestamp() * 1000)
 
-    collection.create_index([("summoner_puuid", 1)])
-    collection.create_index([("info.gameStartTimestamp", 1)])
+async def _build_report_by_day_range(summoners, range, guild_name):
+    print(f"Fetching {range} day report for Guild: {guild_name}...")
+
+    # Every summoner's stats come from a single query
+    summoners_stats = await calculate_guild_stats_by_range(
+        [summoner["puuid"] for summoner in summoners], range=range
+    )
+
+    agg_stats = []
+    for summoner in summoners:
+        weekly_stats_with_name = summoners_stats[summoner["puuid"]].copy()
+        weekly_stats_with_name["Name"] = summoner["name"]
+        agg_stats.append(weekly_stats_with_name)
+
+    # Extract keys excluding 'Name'
+    keys = [key for key in agg_stats[0] if key != "Name"]
+
+    # Initialize a dictionary to store max values and corresponding names
+    max_values = {key: {"value": float("-inf"), "Name": None} for key in keys}
+
+    # Update max_values with the max value for each key and corresponding name
+    for item in agg_stats:
+        for key in keys:
+            if item[key] > max_values[key]["value"]:
+                max_values[key] = {"value": item[key], "Name": item["Name"]}
+
+    # Convert the result into a list of dictionaries as specified
+    result = [
+        {
+            "Key": key,
+            "Max Value": max_values[key]["value"],
+            "Name": max_values[key]["Name"],
+        }
+        for key in max_values
+    ]
 
-    query = {
-        "summoner_puuid": summoner_puuid,
-        "info.gameStartTimestamp": {"$gte": lower_range_epoch},
+    print(
+        f"Finished fetching weekly report for Guild: {guild_name}. Compared stats of {len(summoners)} summoners."
+    )
+    return result
+
+
+# Calculates the stats of a group of summoners (e.g. a guild's members) for the last {range} days
+# All matches are read with one query and a match shared by several summoners is only transferred once
+# With the "rollup" engine the stats are merged from the daily rollups instead
+# With the "numpy" engine every summoner's stats are calculated in one vectorized batch
+# Returns a dictionary of {puuid: stats}, summoners without matches get zeroed stats
+async def calculate_guild_stats_by_range(summoner_puuids, range=7, engine=None):
+    engine = engine or STATS_ENGINE
+    summoner_puuids = list(dict.fromkeys(summoner_puuids))
+    if engine == "rollup":
+        return await rollup_guild_stats(summoner_puuids, _lower_range_epoch(range))
+
+    matches = await read_guild_matches(summoner_puuids, _lower_range_epoch(range))
+
+    participants_by_summoner = group_participants_by_owner(matches, summoner_puuids)
+    if engine == "numpy":
+        all_stats = calculate_participants_batch(list(participants_by_summoner.values()))
+        return dict(zip(participants_by_summoner, all_stats))
+
+    return {
+        puuid: finalize(sum_participants(participants))
+        for puuid, participants in participants_by_summoner.items()
     }
 
-    documents = collection.find(query)
+
+# Fetches all matches stored in database for summoner within a range
+# Matches are pruned to the summoner's participant and the fields needed for stats
+# Concurrent calls for the same summoner and range share a single query
+async def fetch_all_summoner_match_data_by_range(summoner_puuid, range=7):
+    return await match_data_flight.do(
+        (summoner_puuid, range), _fetch_all_summoner_match_data_by_range, summoner_puuid, range
+    )
+
+
+async def _fetch_all_summoner_match_data_by_range(summoner_puuid, range=7):
+    print(f"Fetching all matches for {summoner_puuid} within the last {range} days")
+
+    # Only the summoner's own participant stat fields are read, not the full match documents
+    documents = await read_summoner_matches(summoner_puuid, _lower_range_epoch(range))
 
     if not documents:
         print(
             f"No summoner match data found for {summoner_puuid} within the last {range} days."
         )
-        return None
-    else:
-        return list(documents)
+    return documents
+
+
+# Returns the epoch in milliseconds {range} days ago, the lower bound of a match range query
+def _lower_range_epoch(range):
+    now = datetime.now(timezone.utc)
+    lower_range = now - timedelta(days=range)
+    return int(lower_range.timestamp() * 1000)
 
 
 # Updates the region for every summoner in every guild in the database
@@ -233,7 +484,10 @@ async def update_summoner_region_all(guilds):
             if summoners:
                 for summoner in summoners:
                     region = await get_summoner_region(summoner["puuid"])
-                    result = collection.update_one(
+                    if not region:
+                        # Keep the stored region when the lookup failed
+                        continue
+                    result = await collection.update_one(
                         { 
                             "guild_id": guild.id, 
                             "summoners.puuid": summoner["puuid"] 
@@ -242,6 +496,7 @@ async def update_summoner_region_all(guilds):
                             "$set": { "summoners.$.region": region } 
                         }
                     )
+                    invalidate_guild(guild.id)
 
                     if result.acknowledged:
                         print(
@@ -258,29 +513,15 @@ async def update_summoner_region_all(guilds):
 
 
 # Checks if summoner's data has been fetched yet
+# Use get_cached_summoners() to check several summoners at once
 async def is_summoner_cached(puuid):
-    collection = db.cached_match_data_timestamps
-    is_cached = collection.find_one({"puuid": puuid})
-
-    if is_cached:
-        return True
-    else:
-        return False
+    return puuid in await get_cached_summoners([puuid])
 
 
-# Updates a command analytics in database
-async def update_command_analytics(command):
-    collection = db.command_analytics
-    collection.update_one(
-        {"command_name": command},
-        {"$inc": {"times_called": 1}},
-        upsert=True
-    )
-
 # Updates guild coint in database
 async def update_guild_count(count):
     collection = db.guild_count
-    collection.update_one(
+    await collection.update_one(
         {'_id': ObjectId("660f547946c0829673957eba")},
         {"$set": {'num_guilds': count, "last_updated": datetime.now()}},
         upsert=True
@@ -288,6 +529,4 @@ async def update_guild_count(count):
 
 # Retrieve guild data by id
 async def get_guild_by_id(guild_id):
-    collection = db.discord_servers
-    document = collection.find_one({"guild_id": guild_id})
-    return document
+    return await get_guild_config(guild_id)
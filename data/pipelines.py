@@ -0,0 +1,190 @@
+from utils.stats import FIELD_STATS, participant_fields
+
+
+# Builds an expression object that keeps only the stat fields of the participant bound to $${variable}
+# Generated from the stat definitions, so a new stat is read from the database automatically
+def participant_projection(variable="participant"):
+    projection = {}
+    for field in participant_fields():
+        if field.startswith("challenges."):
+            challenge = field.removeprefix("challenges.")
+            projection.setdefault("challenges", {})[challenge] = f"$${variable}.{field}"
+        else:
+            projection[field] = f"$${variable}.{field}"
+    return projection
+
+
+# Expression for the position of a summoner's participant entry, read from the match's participant_index
+def participant_position(summoner_puuid):
+    return f"$participant_index.{summoner_puuid}"
+
+
+# Expression for the list holding a summoner's participant entry in a match, empty if they did not play in it
+# Slices the entry at its participant_index position, matches stored without the index are scanned
+def summoner_participants(summoner_puuid):
+    position = participant_position(summoner_puuid)
+    return {
+        "$cond": [
+            {"$isNumber": position},
+            {"$slice": ["$info.participants", position, 1]},
+            {
+                "$filter": {
+                    "input": "$info.participants",
+                    "as": "participant",
+                    "cond": {"$eq": ["$$participant.puuid", summoner_puuid]},
+                }
+            },
+        ]
+    }
+
+
+# Pipeline returning a summoner's matches started after lower_range_epoch
+# Each match is pruned server side to its id, start time and the summoner's own participant stat fields
+def summoner_matches_pipeline(summoner_puuid, lower_range_epoch):
+    return [
+        {
+            "$match": {
+                "summoner_puuid": summoner_puuid,
+                "info.gameStartTimestamp": {"$gte": lower_range_epoch},
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "metadata.matchId": 1,
+                "info.gameStartTimestamp": 1,
+                "info.participants": 1,
+                "participant_index": 1,
+            }
+        },
+        {
+            "$addFields": {
+                "info.participants": {
+                    "$map": {
+                        "input": summoner_participants(summoner_puuid),
+                        "as": "participant",
+                        "in": participant_projection(),
+                    }
+                }
+            }
+        },
+        {"$project": {"participant_index": 0}},
+    ]
+
+
+# Expression for a participant field that can be summed: numbers as they are, true as 1, anything else the default
+def summable(path, default=0):
+    return {
+        "$cond": [
+            {"$isNumber": path},
+            path,
+            {"$cond": [{"$eq": [path, True]}, 1, default]},
+        ]
+    }
+
+
+# $group stage totalling the participant entries in the "participant" field of the documents it gets
+# Outputs the number of matches and one running total per stat, keyed by the stat's name
+def stats_group_stage():
+    group = {"_id": None, "matches": {"$sum": 1}}
+    for stat in FIELD_STATS:
+        operator = "$max" if stat.aggregation == "max" else "$sum"
+        group[stat.name] = {operator: summable(f"$participant.{stat.path}", stat.default)}
+    return {"$group": group}
+
+
+# Pipeline calculating a summoner's stat totals inside MongoDB
+# Returns a single document with the number of matches and one running total per stat, keyed by the stat's name
+def summoner_stats_pipeline(summoner_puuid, lower_range_epoch):
+    return [
+        {
+            "$match": {
+                "summoner_puuid": summoner_puuid,
+                "info.gameStartTimestamp": {"$gte": lower_range_epoch},
+            }
+        },
+        {"$project": {"participant": {"$arrayElemAt": [summoner_participants(summoner_puuid), 0]}}},
+        {"$match": {"participant.puuid": summoner_puuid}},
+        stats_group_stage(),
+    ]
+
+
+# Same as summoner_stats_pipeline, for the summoner's compact match slices (match_slices collection)
+def slice_stats_pipeline(summoner_puuid, lower_range_epoch):
+    return [
+        {"$match": {"puuid": summoner_puuid, "game_start": {"$gte": lower_range_epoch}}},
+        stats_group_stage(),
+    ]
+
+
+# Pipeline returning every match of a group of summoners started after lower_range_epoch, in one query
+# A lower_range_epoch of None returns matches regardless of when they started
+# An optional upper_range_epoch excludes matches started at or after it
+# An optional inserted_after ObjectId only returns match documents stored after it
+# Matches stored once per tracked summoner are merged into one document per match id:
+#   owners: the summoners the match was stored for
+#   game_start: the match's gameStartTimestamp
+#   last_id: the newest _id among the match's stored copies
+#   participants: the stat fields of every summoner in the group who played in the match
+def guild_matches_pipeline(summoner_puuids, lower_range_epoch, upper_range_epoch=None, inserted_after=None):
+    match = {"summoner_puuid": {"$in": summoner_puuids}}
+    game_start = {}
+    if lower_range_epoch is not None:
+        game_start["$gte"] = lower_range_epoch
+    if upper_range_epoch is not None:
+        game_start["$lt"] = upper_range_epoch
+    if game_start:
+        match["info.gameStartTimestamp"] = game_start
+    if inserted_after is not None:
+        match["_id"] = {"$gt": inserted_after}
+
+    return [
+        {"$match": match},
+        {
+            "$project": {
+                "summoner_puuid": 1,
+                "metadata.matchId": 1,
+                "info.gameStartTimestamp": 1,
+                "info.participants": 1,
+            }
+        },
+        {
+            "$addFields": {
+                "info.participants": {
+                    "$map": {
+                        "input": {
+                            "$filter": {
+                                "input": "$info.participants",
+                                "as": "participant",
+                                "cond": {"$in": ["$$participant.puuid", summoner_puuids]},
+                            }
+                        },
+                        "as": "participant",
+                        "in": participant_projection(),
+                    }
+                }
+            }
+        },
+        {
+            "$group": {
+                "_id": "$metadata.matchId",
+                "owners": {"$addToSet": "$summoner_puuid"},
+                "game_start": {"$first": "$info.gameStartTimestamp"},
+                "last_id": {"$max": "$_id"},
+                "participants": {"$first": "$info.participants"},
+            }
+        },
+    ]
+
+
+# Splits the output of guild_matches_pipeline into each summoner's participant entries
+# A match only counts for the summoners it was stored for, as with the per summoner queries
+# Returns a dictionary of {puuid: [participant, ...]}
+def group_participants_by_owner(matches, summoner_puuids):
+    participants_by_summoner = {puuid: [] for puuid in summoner_puuids}
+    for match in matches:
+        participants = {participant["puuid"]: participant for participant in match["participants"]}
+        for owner in match["owners"]:
+            if owner in participants and owner in participants_by_summoner:
+                participants_by_summoner[owner].append(participants[owner])
+    return participants_by_summoner
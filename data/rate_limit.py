@@ -0,0 +1,127 @@
+import asyncio
+import time
+
+# Extra time added to every local window so it never resets before Riot's does
+# Riot starts its window when the request arrives, which is slightly after we send it
+# The padding is a share of the window, capped so it covers network latency without wasting short windows
+WINDOW_PADDING_RATIO = 0.05
+MAX_WINDOW_PADDING = 0.1
+
+
+# Returns when a window of the given length starting now resets, padding included
+def window_reset(now, seconds):
+    return now + seconds + min(seconds * WINDOW_PADDING_RATIO, MAX_WINDOW_PADDING)
+
+
+# Parses a Riot rate limit header into a dictionary of {window seconds: value}
+# Example: "20:1,100:120" -> {1: 20, 120: 100}
+def parse_rate_limit_header(header):
+    limits = {}
+    if not header:
+        return limits
+
+    for part in header.split(","):
+        try:
+            value, seconds = part.strip().split(":")
+            limits[int(seconds)] = int(value)
+        except ValueError:
+            print(f"Ignoring malformed rate limit header entry '{part}'.")
+
+    return limits
+
+
+# Tracks the request windows for a single rate limit (one app or one method limit on one host)
+class RateLimitBucket:
+    def __init__(self, limits=None):
+        self.limits = dict(limits or {})  # window seconds -> max requests
+        self.windows = {}  # window seconds -> [count, reset_at]
+        self.blocked_until = 0
+
+    # Returns how many seconds a request has to wait before it fits in every window
+    def delay(self, now):
+        wait = max(0, self.blocked_until - now)
+        for seconds, limit in self.limits.items():
+            window = self.windows.get(seconds)
+            if window and now < window[1] and window[0] >= limit:
+                wait = max(wait, window[1] - now)
+        return wait
+
+    # Counts a request against every window, starting new windows where the old ones expired
+    def consume(self, now):
+        for seconds in self.limits:
+            window = self.windows.get(seconds)
+            if window is None or now >= window[1]:
+                self.windows[seconds] = [1, window_reset(now, seconds)]
+            else:
+                window[0] += 1
+
+    # Syncs limits and counts with the values Riot reported in the response headers
+    def update(self, limit_header, count_header, now):
+        limits = parse_rate_limit_header(limit_header)
+        if limits:
+            self.limits = limits
+
+        for seconds, count in parse_rate_limit_header(count_header).items():
+            window = self.windows.get(seconds)
+            if window is None or now >= window[1]:
+                self.windows[seconds] = [count, window_reset(now, seconds)]
+            else:
+                window[0] = max(window[0], count)
+
+    # Blocks the bucket entirely, used when Riot answers with a 429
+    def block(self, retry_after, now):
+        self.blocked_until = max(self.blocked_until, now + retry_after)
+
+
+# Proactive rate limiter for the Riot API
+# Keeps one app bucket per routing host (na1, euw1, americas, ...) and one method bucket per (host, endpoint)
+# Requests wait in acquire() until they fit in both buckets instead of being rejected with a 429
+class RateLimiter:
+    def __init__(self, default_app_limits=None):
+        self.default_app_limits = parse_rate_limit_header(default_app_limits)
+        self.app_buckets = {}
+        self.method_buckets = {}
+
+    def _buckets(self, host, method):
+        app_bucket = self.app_buckets.get(host)
+        if app_bucket is None:
+            app_bucket = self.app_buckets[host] = RateLimitBucket(self.default_app_limits)
+
+        method_bucket = self.method_buckets.get((host, method))
+        if method_bucket is None:
+            method_bucket = self.method_buckets[(host, method)] = RateLimitBucket()
+
+        return app_bucket, method_bucket
+
+    # Waits until a request to the endpoint on the host is allowed, then counts it
+    async def acquire(self, host, method):
+        buckets = self._buckets(host, method)
+        while True:
+            now = time.monotonic()
+            wait = max(bucket.delay(now) for bucket in buckets)
+            if wait <= 0:
+                for bucket in buckets:
+                    bucket.consume(now)
+                return
+            await asyncio.sleep(wait)
+
+    # Updates the buckets from the X-App-Rate-Limit / X-Method-Rate-Limit headers of a response
+    def update(self, host, method, headers):
+        app_bucket, method_bucket = self._buckets(host, method)
+        now = time.monotonic()
+        app_bucket.update(
+            headers.get("X-App-Rate-Limit"), headers.get("X-App-Rate-Limit-Count"), now
+        )
+        method_bucket.update(
+            headers.get("X-Method-Rate-Limit"), headers.get("X-Method-Rate-Limit-Count"), now
+        )
+
+    # Blocks the bucket that caused a 429 for Retry-After seconds
+    # Service (underlying server) limits only block the endpoint that returned them
+    def block(self, host, method, retry_after, limit_type=None):
+        app_bucket, method_bucket = self._buckets(host, method)
+        now = time.monotonic()
+        if limit_type == "application":
+            app_bucket.block(retry_after, now)
+        else:
+            method_bucket.block(retry_after, now)
@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta, timezone
+
+from config import REPORT_SNAPSHOT_MAX_AGE_MINUTES
+from data.database import db
+from data.ingestion import get_cached_summoners
+from data.mongo import build_report_by_day_range, get_guild_config, report_key
+import utils.metrics as metrics
+
+# Guild reports, ready to be rendered into embeds
+#   stats: the report, as returned by build_report_by_day_range
+#   summoners: names of the guild's summoners
+#   summoners_not_cached: names of the summoners whose matches were not fetched yet
+# Automated weekly reports are precomputed before they are sent and stored in report_snapshots,
+# one document per (guild, range) whose _id is "<guild_id>:<range>"
+# A snapshot holds the stats and the report_key() they were computed for, it is only used while the guild's
+# summoners and their data versions still match that key. The cache status of the summoners is always checked anew
+
+
+def _snapshot_id(guild_id, range):
+    return f"{guild_id}:{range}"
+
+
+# Returns a guild's summoners and name, None when the guild has no summoners
+async def _guild_summoners(guild_id):
+    guild = await get_guild_config(guild_id)
+    if not guild or not guild.get("summoners"):
+        print(f"No summoners found for guild with id {guild_id}.")
+        return None
+    return guild["summoners"], guild.get("name", "None")
+
+
+# Turns a report's stats into a guild report, checking the summoners' cache status with a single query
+async def _guild_report(summoners, stats):
+    if not stats:
+        return None
+
+    cached = await get_cached_summoners([summoner["puuid"] for summoner in summoners])
+    return {
+        "stats": stats,
+        "summoners": [summoner["name"] for summoner in summoners],
+        "summoners_not_cached": [summoner["name"] for summoner in summoners if summoner["puuid"] not in cached],
+    }
+
+
+# Computes a guild's report for the last {range} days, None if it could not be computed
+async def compute_guild_report(guild_id, range=7):
+    guild = await _guild_summoners(guild_id)
+    if guild is None:
+        return None
+
+    summoners, guild_name = guild
+    stats = await build_report_by_day_range(summoners, range, guild_name)
+    return await _guild_report(summoners, stats)
+
+
+# Computes a guild's report and stores its stats as the guild's snapshot for that range
+async def precompute_guild_report(guild_id, range=7):
+    guild = await _guild_summoners(guild_id)
+    if guild is None:
+        return None
+
+    summoners, guild_name = guild
+    key = await report_key(summoners, range)
+    stats = await build_report_by_day_range(summoners, range, guild_name, key=key)
+    if stats:
+        await db.report_snapshots.replace_one(
+            {"_id": _snapshot_id(guild_id, range)},
+            {
+                "guild_id": guild_id,
+                "range": range,
+                "key": key,
+                "stats": stats,
+                "computed_at": datetime.now(timezone.utc),
+            },
+            upsert=True,
+        )
+    return await _guild_report(summoners, stats)
+
+
+# Returns a guild's report from its snapshot for the range, None unless the snapshot was computed in the
+# last REPORT_SNAPSHOT_MAX_AGE_MINUTES for the guild's current summoners and data versions
+async def get_report_snapshot(guild_id, range=7):
+    guild = await _guild_summoners(guild_id)
+    if guild is None:
+        return None
+
+    summoners = guild[0]
+    oldest = datetime.now(timezone.utc) - timedelta(minutes=REPORT_SNAPSHOT_MAX_AGE_MINUTES)
+    snapshot = await db.report_snapshots.find_one(
+        {
+            "_id": _snapshot_id(guild_id, range),
+            "key": await report_key(summoners, range),
+            "computed_at": {"$gte": oldest},
+        },
+        {"_id": 0, "stats": 1},
+    )
+    metrics.incr("reports.snapshot_hits" if snapshot else "reports.snapshot_misses")
+    if snapshot is None:
+        return None
+    return await _guild_report(summoners, snapshot["stats"])
+
+
+# Returns a guild's report, from a valid snapshot when there is one
+async def fetch_guild_report(guild_id, range=7):
+    snapshot = await get_report_snapshot(guild_id, range)
+    if snapshot is not None:
+        return snapshot
+    return await compute_guild_report(guild_id, range)
+
+
+# Returns the ids of the guilds with a main channel, the ones automated reports are sent to
+async def get_report_guild_ids():
+    cursor = db.discord_servers.find({"main_channel_id": {"$ne": None}}, {"_id": 0, "guild_id": 1})
+    return [guild["guild_id"] async for guild in cursor]
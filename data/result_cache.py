@@ -0,0 +1,79 @@
+import hashlib
+import time
+from datetime import datetime, timedelta, timezone
+
+from config import RESULT_CACHE_SHARED, RESULT_CACHE_SIZE, RESULT_CACHE_TTL
+from data.database import db
+import utils.metrics as metrics
+from utils.cache import LRUCache
+
+# Cache of computed results (summoner stats, guild reports)
+# Keys include the data version of every summoner a result was calculated from (see summoner_data_versions),
+# so new matches make a new key instead of having to invalidate the old one
+# Ranges are relative to the current time, entries expire after RESULT_CACHE_TTL seconds so a result
+# never lags the sliding range by more than that
+# With RESULT_CACHE_SHARED, entries are also stored in the result_cache collection and shared between processes
+# Records "result_cache.hits", "result_cache.misses", the "result_cache.hit_ratio" gauge
+# and the compute time hits saved in "result_cache.saved_seconds"
+
+result_cache = LRUCache(maxsize=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL)
+_MISS = object()
+
+
+# Returns a stable key for the given parts, e.g. ("stats", puuid, range, engine, version)
+def result_key(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+# Returns the cached result for key, or computes it with compute() and caches it
+async def cached_result(key, compute):
+    entry = result_cache.get(key, _MISS)
+    if entry is _MISS and RESULT_CACHE_SHARED:
+        entry = await _get_shared(key)
+
+    if entry is not _MISS:
+        value, compute_seconds = entry
+        _record(hit=True)
+        metrics.incr("result_cache.saved_seconds", compute_seconds)
+        return value
+
+    _record(hit=False)
+    started = time.perf_counter()
+    value = await compute()
+    compute_seconds = time.perf_counter() - started
+    if value is not None:
+        result_cache.set(key, (value, compute_seconds))
+        if RESULT_CACHE_SHARED:
+            await _set_shared(key, value, compute_seconds)
+    return value
+
+
+def _record(hit):
+    metrics.incr("result_cache.hits" if hit else "result_cache.misses")
+    hits = metrics.counters["result_cache.hits"]
+    metrics.gauge("result_cache.hit_ratio", round(hits / (hits + metrics.counters["result_cache.misses"]), 4))
+
+
+# Results are dictionaries keyed by stat labels (which contain dots) or lists, dictionaries are stored as pairs
+async def _get_shared(key):
+    now = datetime.now(timezone.utc)
+    document = await db.result_cache.find_one({"_id": key, "expires_at": {"$gt": now}})
+    if document is None:
+        return _MISS
+
+    value = dict(document["items"]) if "items" in document else document["value"]
+    expires_at = document["expires_at"].replace(tzinfo=timezone.utc)
+    result_cache.set(key, (value, document["compute_seconds"]), ttl=(expires_at - now).total_seconds())
+    return value, document["compute_seconds"]
+
+
+async def _set_shared(key, value, compute_seconds):
+    document = {
+        "compute_seconds": compute_seconds,
+        "expires_at": datetime.now(timezone.utc) + timedelta(seconds=RESULT_CACHE_TTL),
+    }
+    if isinstance(value, dict):
+        document["items"] = [[item_key, item_value] for item_key, item_value in value.items()]
+    else:
+        document["value"] = value
+    await db.result_cache.replace_one({"_id": key}, document, upsert=True)
@@ -5,6 +5,21 @@ from dotenv import load_dotenv
 from datetime import datetime, timedelta
 import re
 import asyncio
+from urllib.parse import urlencode, urlparse
+
+from config import (
+    RIOT_API_BASE_URL,
+    RIOT_POOL_LIMIT,
+    RIOT_POOL_LIMIT_PER_HOST,
+    RIOT_DNS_CACHE_TTL,
+    RIOT_KEEPALIVE_TIMEOUT,
+    RIOT_REQUEST_TIMEOUT,
+    RIOT_DEFAULT_APP_RATE_LIMIT,
+    RIOT_MAX_RETRIES,
+    RIOT_REGION_PROBE_CONCURRENCY,
+)
+from data.rate_limit import RateLimiter
+from utils.singleflight import SingleFlight
 
 # Load environment variables from .env file
 load_dotenv()
@@ -28,71 +43,280 @@ regions = [
     "vn2"
 ]
 
+# Regional routing value serving match-v5 for each platform
+REGION_ROUTING = {
+    "na1": "americas",
+    "br1": "americas",
+    "la1": "americas",
+    "la2": "americas",
+    "euw1": "europe",
+    "eun1": "europe",
+    "tr1": "europe",
+    "ru": "europe",
+    "kr": "asia",
+    "jp1": "asia",
+    "oc1": "sea",
+    "ph2": "sea",
+    "sg2": "sea",
+    "th2": "sea",
+    "tw2": "sea",
+    "vn2": "sea",
+}
+
+# Maximum number of match ids match-v5 returns per call
+MATCH_IDS_PAGE_SIZE = 100
+
+
+# Builds a Riot API url for a platform or regional routing host
+def riot_url(host, path, **params):
+    params["api_key"] = os.getenv("RIOT_API_KEY")
+    return f"{RIOT_API_BASE_URL.format(host=host)}{path}?{urlencode(params)}"
+
+
+# Shared HTTP session used for every Riot API call
+# Created by the bot in setup_hook and closed on shutdown so connections are kept alive between calls
+session = None
+
+
+# Opens the shared Riot HTTP session
+# The connector keeps a pool of keep-alive connections per regional host and caches DNS lookups
+async def open_session():
+    global session
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=RIOT_POOL_LIMIT,
+            limit_per_host=RIOT_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=RIOT_DNS_CACHE_TTL,
+            keepalive_timeout=RIOT_KEEPALIVE_TIMEOUT,
+        )
+        session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=RIOT_REQUEST_TIMEOUT),
+        )
+        print(
+            f"Opened Riot HTTP session (pool limit={RIOT_POOL_LIMIT}, per host={RIOT_POOL_LIMIT_PER_HOST})."
+        )
+    return session
+
+
+# Closes the shared Riot HTTP session
+async def close_session():
+    global session
+    if session is not None and not session.closed:
+        await session.close()
+        print("Closed Riot HTTP session.")
+    session = None
+
+
+# Returns the shared Riot HTTP session
+# Opens one lazily when called outside of the bot (e.g. admin scripts)
+async def get_session():
+    if session is None or session.closed:
+        return await open_session()
+    return session
+
+
+# Rate limiter shared by every Riot API call made by this process
+rate_limiter = RateLimiter(default_app_limits=RIOT_DEFAULT_APP_RATE_LIMIT)
+
+# Coalesces identical in-flight Riot requests, keyed by URL
+riot_flight = SingleFlight("riot.singleflight")
+
+# Method identifiers used to key the per-endpoint rate limit buckets
+ACCOUNT_BY_RIOT_ID = "account-v1.by-riot-id"
+ACCOUNT_REGION_BY_PUUID = "account-v1.region-by-puuid"
+SUMMONER_BY_PUUID = "summoner-v4.by-puuid"
+MATCH_IDS_BY_PUUID = "match-v5.ids-by-puuid"
+MATCH_BY_ID = "match-v5.by-id"
+
+
+# Sends a GET request, coalescing identical requests that are already in flight
+# Returns a tuple of (status, data) where data is only set for a 200 response
+async def _get(url, method=None):
+    return await riot_flight.do(url, _request, url, method)
+
+
+# Sends a GET request through the rate limiter
+# Waits proactively for rate limit capacity and retries a limited number of times on 429
+async def _request(url, method=None):
+    session = await get_session()
+    parsed_url = urlparse(url)
+    host = parsed_url.hostname.split(".")[0]
+    method = method or parsed_url.path
+
+    for attempt in range(RIOT_MAX_RETRIES + 1):
+        await rate_limiter.acquire(host, method)
+        async with session.get(url) as response:
+            rate_limiter.update(host, method, response.headers)
+
+            if response.status == 429:  # Rate limit exceeded
+                retry_after = int(response.headers.get("Retry-After", 1))
+                limit_type = response.headers.get("X-Rate-Limit-Type")
+                rate_limiter.block(host, method, retry_after, limit_type)
+                print(
+                    f"Rate limit ({limit_type}) exceeded on {host} for {method}. Retrying in {retry_after} seconds."
+                )
+                continue
+
+            if response.status == 200:
+                return response.status, await response.json()
+            return response.status, None
+
+    print(f"Giving up on {method} after {RIOT_MAX_RETRIES} rate limited retries.")
+    return 429, None
+
+
 # Handler function for all API calls made
-# Contains error handling and backup rate limit handling
-async def handle_api_call(url):
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(url) as response:
-                if response.status == 429:  # Rate limit exceeded
-                    retry_after = int(response.headers.get("Retry-After", 1))
-                    print(f"Rate limit exceeded. Retrying in {retry_after} seconds.")
-                    await asyncio.sleep(retry_after)
-                    return await handle_api_call(url)  # Retry the request
-                response.raise_for_status()  # Raise an exception for non-200 status codes
-                data = await response.json()
-                return data
-        except aiohttp.ClientResponseError as e:
-            print(f"Error in API call: {e.status}, message='{e.message}'")
-            return None
-        
+# Contains error handling, rate limiting is done by the shared rate limiter
+async def handle_api_call(url, method=None):
+    status, data = await _get(url, method)
+    if status != 200:
+        print(f"Error in API call: {status}, url='{urlparse(url).path}'")
+        return None
+    return data
 
 
-async def handle_api_call_no_exception(url):
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    return await response.json()
-                if response.status == 429:  # Rate limit exceeded
-                    retry_after = int(response.headers.get("Retry-After", 1))
-                    print(f"Rate limit exceeded. Retrying in {retry_after} seconds.")
-                    await asyncio.sleep(retry_after)
-                    return await handle_api_call_no_exception(url)  #
-                else:
-                    # Log or handle unsuccessful API call (e.g., response status not 200)
-                    print(f"API call failed with status code: {response.status}")
-                    return None
-        except Exception as e:
-            # Log or handle any exceptions raised during the API call
-            print(f"An error occurred during API call to {url}: {str(e)}")
+# Same as _get, returns a status of None when the request failed (timeout, connection error, ...)
+async def _get_no_exception(url, method=None):
+    try:
+        return await _get(url, method)
+    except Exception as e:
+        print(f"An error occurred during API call to {url}: {str(e)}")
+        return None, None
+
+
+async def handle_api_call_no_exception(url, method=None):
+    try:
+        status, data = await _get(url, method)
+        if status != 200:
+            # Log or handle unsuccessful API call (e.g., response status not 200)
+            print(f"API call failed with status code: {status}")
             return None
+        return data
+    except Exception as e:
+        # Log or handle any exceptions raised during the API call
+        print(f"An error occurred during API call to {url}: {str(e)}")
+        return None
 
 
 # Fetches a summoner's puuid from their riot id
 # Checks if riot id is in proper format
 async def fetch_summoner_puuid_by_riot_id(summoner_riot_id):
+    puuid, found = await lookup_summoner_puuid_by_riot_id(summoner_riot_id)
+    return puuid
+
+
+# Looks up a summoner's puuid from their riot id
+# Returns a tuple of (puuid, found) where found is False when the account does not exist
+# and None when the lookup failed for another reason (rate limits, server errors, ...)
+async def lookup_summoner_puuid_by_riot_id(summoner_riot_id):
     is_proper_format = check_riot_id_format(summoner_riot_id)
 
     if is_proper_format:
         game_name, tag = summoner_riot_id.split(" #")
-        url = f"https://americas.api.riotgames.com/riot/account/v1/accounts/by-riot-id/{game_name}/{tag}?api_key={os.getenv("RIOT_API_KEY")}"
-        data = await handle_api_call(url)
-        return data["puuid"] if data is not None else None
+        url = riot_url("americas", f"/riot/account/v1/accounts/by-riot-id/{game_name}/{tag}")
+        status, data = await _get(url, method=ACCOUNT_BY_RIOT_ID)
+        if status == 200:
+            return data["puuid"], True
+
+        print(f"Error in API call: {status}, url='{urlparse(url).path}'")
+        return None, (False if status in (400, 404) else None)
     else:
         print(f"Failed to fetch summoner puuid. {summoner_riot_id} is not a valid Riot ID.")
-        return None
+        return None, False
 
 
-# Returns the Region a Summoner is from
+# Returns the Region a Summoner is from, None if it could not be found
 async def get_summoner_region(summoner_puuid):
-    for region in regions:
-        url = f"https://{region}.api.riotgames.com/lol/summoner/v4/summoners/by-puuid/{summoner_puuid}?api_key={os.getenv("RIOT_API_KEY")}"
-        data = await handle_api_call_no_exception(url)
-        if data:
-            return region
-    
-    return None
+    region, found = await lookup_summoner_region(summoner_puuid)
+    return region
+
+
+# Looks up the Region a Summoner is from
+# Asks account-v1 for the summoner's active region first, which is a single call
+# Falls back to probing every platform host concurrently when that lookup fails
+# Returns a tuple of (region, found) where found is False when no platform knows the summoner
+# and None when the lookup failed for another reason (rate limits, timeouts, server errors, ...)
+async def lookup_summoner_region(summoner_puuid):
+    url = riot_url("americas", f"/riot/account/v1/region/by-game/lol/by-puuid/{summoner_puuid}")
+    status, data = await _get_no_exception(url, method=ACCOUNT_REGION_BY_PUUID)
+    if status == 200 and data and data.get("region") in regions:
+        return data["region"], True
+
+    return await probe_summoner_region(summoner_puuid)
+
+
+# Probes every platform host for the summoner concurrently
+# The first host to answer with the summoner wins and the remaining probes are cancelled
+# Concurrency is capped so the fan-out stays within the rate limiter's budget
+# Returns a tuple of (region, found) like lookup_summoner_region, found is False only when every host answered 404
+async def probe_summoner_region(summoner_puuid):
+    semaphore = asyncio.Semaphore(RIOT_REGION_PROBE_CONCURRENCY)
+
+    async def probe(region):
+        async with semaphore:
+            url = riot_url(region, f"/lol/summoner/v4/summoners/by-puuid/{summoner_puuid}")
+            status, data = await _get_no_exception(url, method=SUMMONER_BY_PUUID)
+            return (region if status == 200 and data else None), status
+
+    statuses = []
+    probes = [asyncio.create_task(probe(region)) for region in regions]
+    try:
+        for next_probe in asyncio.as_completed(probes):
+            region, status = await next_probe
+            if region:
+                return region, True
+            statuses.append(status)
+    finally:
+        for pending_probe in probes:
+            pending_probe.cancel()
+
+    print(f"Failed to find the region of summoner {summoner_puuid}, statuses: {statuses}")
+    return None, (False if all(status == 404 for status in statuses) else None)
+
+
+# Fetches the ids of a summoner's matches started at or after start_time (epoch seconds), newest first
+# Pages through every result, returns None when a call fails (error status, timeout, connection error)
+# so the caller can retry later, or when the region is unknown since match-v5 only lists a summoner's
+# matches on the routing value of their region
+async def fetch_match_ids(summoner_puuid, region, start_time=None, queue=None):
+    routing = REGION_ROUTING.get(region)
+    if routing is None:
+        print(f"Cannot list the matches of {summoner_puuid}, unknown region {region}.")
+        return None
+    match_ids = []
+    while True:
+        params = {"start": len(match_ids), "count": MATCH_IDS_PAGE_SIZE}
+        if start_time is not None:
+            params["startTime"] = start_time
+        if queue is not None:
+            params["queue"] = queue
+
+        url = riot_url(routing, f"/lol/match/v5/matches/by-puuid/{summoner_puuid}/ids", **params)
+        try:
+            status, data = await _get(url, method=MATCH_IDS_BY_PUUID)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # A timeout or connection error only fails this summoner's listing, not the whole ingestion tick
+            print(f"An error occurred during API call to {urlparse(url).path}: {e!r}")
+            return None
+        if status != 200:
+            print(f"Error in API call: {status}, url='{urlparse(url).path}'")
+            return None
+
+        match_ids.extend(data)
+        if len(data) < MATCH_IDS_PAGE_SIZE:
+            return match_ids
+
+
+# Fetches a match from match-v5, returns None when the call fails or the region is unknown
+async def fetch_match(match_id, region):
+    routing = REGION_ROUTING.get(region)
+    if routing is None:
+        print(f"Cannot fetch match {match_id}, unknown region {region}.")
+        return None
+    url = riot_url(routing, f"/lol/match/v5/matches/{match_id}")
+    return await handle_api_call_no_exception(url, method=MATCH_BY_ID)
+
 
 # Checks to make sure provided riot id follows format: 'String1 #String2'
 # Keep in mind there can be any number of strings before the #
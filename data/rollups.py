@@ -0,0 +1,240 @@
+from datetime import datetime, timedelta, timezone
+from numbers import Number
+from bson.objectid import ObjectId
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from config import ROLLUP_LOOKBACK_HOURS
+from data.database import db
+from data.matches import read_guild_matches
+from data.pipelines import group_participants_by_owner
+from utils.stats import FIELD_STATS, MATCHES_LABEL, STATS_FINGERPRINT, finalize, merge_totals, sum_participants
+
+# Daily stat rollups: one document per (summoner, UTC day) in summoner_daily_rollups holding
+#   matches: the number of matches counted
+#   totals: the running total of every stat over those matches (highest value for "max" stats), keyed by the stat's name
+#   match_ids: the matches counted, so applying the same match twice is a no-op
+# summoner_rollup_state keeps, per summoner, the _id of the newest stored match document rolled up (last_id)
+# and the STATS_FINGERPRINT of the stats the rollups hold (fingerprint)
+# Document _ids grow with insertion time, so matches that land late for an old game are still picked up
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+# Returns the UTC day a match started on, as a midnight datetime
+def match_day(game_start_timestamp):
+    return datetime.fromtimestamp(game_start_timestamp // DAY_MS * DAY_MS / 1000, timezone.utc)
+
+
+def _rollup_id(summoner_puuid, day):
+    return f"{summoner_puuid}:{day:%Y-%m-%d}"
+
+
+# Returns a stat's value as something $inc accepts, counting true as 1 like the Python engine
+def _summable_value(stat, participant):
+    value = stat.read(participant)
+    if isinstance(value, bool):
+        return int(value)
+    return value if isinstance(value, Number) else stat.default
+
+
+# Builds the update adding one match to a summoner's daily rollup
+# The match id guard turns a repeated update into a duplicate key error instead of counting it twice
+def rollup_update(summoner_puuid, match_id, game_start_timestamp, participant):
+    day = match_day(game_start_timestamp)
+    increments = {"matches": 1}
+    maxima = {}
+    for stat in FIELD_STATS:
+        value = _summable_value(stat, participant)
+        if stat.aggregation == "max":
+            maxima[f"totals.{stat.name}"] = value
+        else:
+            increments[f"totals.{stat.name}"] = value
+
+    update = {
+        "$inc": increments,
+        "$push": {"match_ids": match_id},
+        "$setOnInsert": {"puuid": summoner_puuid, "day": day},
+    }
+    if maxima:
+        update["$max"] = maxima
+
+    return UpdateOne(
+        {"_id": _rollup_id(summoner_puuid, day), "match_ids": {"$ne": match_id}},
+        update,
+        upsert=True,
+    )
+
+
+# Applies rollup updates in one bulk write, ignoring the ones for matches that were already counted
+async def apply_rollup_updates(updates):
+    if not updates:
+        return
+
+    try:
+        await db.summoner_daily_rollups.bulk_write(updates, ordered=False)
+    except BulkWriteError as e:
+        # Duplicate key errors mean the match was already counted in that day's rollup
+        errors = [error for error in e.details["writeErrors"] if error["code"] != 11000]
+        if errors:
+            raise
+
+
+# Brings the rollups of the given summoners up to date with the stored matches
+# Only match documents stored after each summoner's watermark (minus a lookback for clock skew) are read
+# Summoners that were never rolled up, or whose rollups hold other stats than the current ones, are rebuilt from scratch
+async def refresh_rollups(summoner_puuids):
+    states = await db.summoner_rollup_state.find(
+        {"_id": {"$in": summoner_puuids}, "fingerprint": STATS_FINGERPRINT}
+    ).to_list(length=None)
+    watermarks = {state["_id"]: state.get("last_id") for state in states}
+
+    for summoner_puuid in summoner_puuids:
+        if summoner_puuid not in watermarks:
+            await rebuild_summoner_rollups(summoner_puuid)
+
+    # Summoners without any rolled up match yet have no watermark, everything stored for them is read
+    with_watermark = [puuid for puuid in summoner_puuids if watermarks.get(puuid)]
+    without_watermark = [
+        puuid for puuid in summoner_puuids if puuid in watermarks and not watermarks[puuid]
+    ]
+
+    if with_watermark:
+        oldest = min(watermarks[puuid] for puuid in with_watermark)
+        inserted_after = ObjectId.from_datetime(
+            oldest.generation_time - timedelta(hours=ROLLUP_LOOKBACK_HOURS)
+        )
+        await _roll_up_new_matches(with_watermark, inserted_after)
+    if without_watermark:
+        await _roll_up_new_matches(without_watermark, None)
+
+
+# Rolls up the matches of the given summoners stored after inserted_after and advances their watermark
+async def _roll_up_new_matches(summoner_puuids, inserted_after):
+    matches = await read_guild_matches(summoner_puuids, None, inserted_after=inserted_after)
+    if not matches:
+        return
+
+    updates = []
+    for match in matches:
+        participants = {participant["puuid"]: participant for participant in match["participants"]}
+        for owner in match["owners"]:
+            if owner in participants:
+                updates.append(rollup_update(owner, match["_id"], match["game_start"], participants[owner]))
+
+    await apply_rollup_updates(updates)
+
+    # Everything stored before the newest document read has now been rolled up for these summoners
+    last_id = max(match["last_id"] for match in matches)
+    await db.summoner_rollup_state.update_many(
+        {"_id": {"$in": summoner_puuids}}, {"$max": {"last_id": last_id}}
+    )
+
+
+# Rebuilds every daily rollup of a summoner from the stored matches
+# Safe to run while the bot is serving stats, rollups are replaced rather than deleted first
+async def rebuild_summoner_rollups(summoner_puuid):
+    matches = await read_guild_matches([summoner_puuid], None)
+
+    rollups = {}
+    last_id = None
+    for match in matches:
+        participant = next(
+            (obj for obj in match["participants"] if obj["puuid"] == summoner_puuid), None
+        )
+        if participant is None:
+            continue
+
+        day = match_day(match["game_start"])
+        rollup = rollups.setdefault(
+            day,
+            {
+                "_id": _rollup_id(summoner_puuid, day),
+                "puuid": summoner_puuid,
+                "day": day,
+                "matches": 0,
+                "totals": {stat.name: 0 for stat in FIELD_STATS},
+                "match_ids": [],
+            },
+        )
+        rollup["matches"] += 1
+        rollup["match_ids"].append(match["_id"])
+        for stat in FIELD_STATS:
+            value = _summable_value(stat, participant)
+            if stat.aggregation == "max":
+                rollup["totals"][stat.name] = max(rollup["totals"][stat.name], value)
+            else:
+                rollup["totals"][stat.name] += value
+        last_id = max(last_id, match["last_id"]) if last_id else match["last_id"]
+
+    if rollups:
+        await db.summoner_daily_rollups.bulk_write(
+            [ReplaceOne({"_id": rollup["_id"]}, rollup, upsert=True) for rollup in rollups.values()],
+            ordered=False,
+        )
+    await db.summoner_daily_rollups.delete_many(
+        {"puuid": summoner_puuid, "_id": {"$nin": [rollup["_id"] for rollup in rollups.values()]}}
+    )
+    await db.summoner_rollup_state.update_one(
+        {"_id": summoner_puuid}, {"$set": {"last_id": last_id, "fingerprint": STATS_FINGERPRINT}}, upsert=True
+    )
+    print(f"Rebuilt {len(rollups)} daily rollups from {len(matches)} matches for {summoner_puuid}.")
+
+
+# Rebuilds the rollups of every summoner with cached match data
+# Does not get called anywhere, mainly for admin use (initial backfill)
+# Rollups of other stat definitions are rebuilt on their next refresh, this rebuilds them all ahead of time
+async def backfill_rollups():
+    summoner_puuids = await db.cached_match_data_timestamps.distinct("puuid")
+    for summoner_puuid in summoner_puuids:
+        await rebuild_summoner_rollups(summoner_puuid)
+    print(f"Backfilled daily rollups for {len(summoner_puuids)} summoners.")
+
+
+# Calculates the stats of a group of summoners for matches started after lower_range_epoch from their rollups
+# Whole days come from the rollups, the partial first day of the range is read from the raw matches
+# Returns a dictionary of {puuid: stats}, the same as calculating from the raw matches
+async def rollup_guild_stats(summoner_puuids, lower_range_epoch):
+    summoner_puuids = list(dict.fromkeys(summoner_puuids))
+    await refresh_rollups(summoner_puuids)
+
+    first_full_day = -(-lower_range_epoch // DAY_MS) * DAY_MS
+    totals_by_summoner = {puuid: sum_participants([]) for puuid in summoner_puuids}
+
+    rollups = await db.summoner_daily_rollups.find(
+        {"puuid": {"$in": summoner_puuids}, "day": {"$gte": match_day(first_full_day)}},
+        {"match_ids": 0},
+    ).to_list(length=None)
+    for rollup in rollups:
+        totals = sum_participants([])
+        totals[MATCHES_LABEL] = rollup["matches"]
+        for stat in FIELD_STATS:
+            totals[stat.label] = rollup["totals"].get(stat.name, stat.default)
+        merge_totals(totals_by_summoner[rollup["puuid"]], totals)
+
+    if lower_range_epoch < first_full_day:
+        matches = await read_guild_matches(summoner_puuids, lower_range_epoch, first_full_day)
+        for puuid, participants in group_participants_by_owner(matches, summoner_puuids).items():
+            merge_totals(totals_by_summoner[puuid], sum_participants(participants))
+
+    return {puuid: finalize(totals) for puuid, totals in totals_by_summoner.items()}
+
+
+# Compares a summoner's rollup stats with stats calculated from the raw matches
+# Does not get called anywhere, mainly for admin use. Returns True when both agree
+async def check_rollup_consistency(summoner_puuid, lower_range_epoch):
+    rollup_stats = (await rollup_guild_stats([summoner_puuid], lower_range_epoch))[summoner_puuid]
+
+    matches = await read_guild_matches([summoner_puuid], lower_range_epoch)
+    participants = group_participants_by_owner(matches, [summoner_puuid])[summoner_puuid]
+    raw_stats = finalize(sum_participants(participants))
+
+    mismatches = {
+        key: (rollup_stats[key], raw_stats[key])
+        for key in raw_stats
+        if rollup_stats[key] != raw_stats[key]
+    }
+    for key, (rollup_value, raw_value) in mismatches.items():
+        print(f"Rollup mismatch for {summoner_puuid} on {key}: rollup={rollup_value}, raw={raw_value}")
+
+    return not mismatches
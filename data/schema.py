@@ -0,0 +1,94 @@
+from pymongo.errors import OperationFailure
+
+from data.database import db
+
+# Indexes the bot's queries rely on, created once at startup instead of on the query path
+# Each entry is (collection name, index keys, index options)
+INDEXES = [
+    # Match range queries filter on one summoner and a start time range
+    (
+        "cached_match_data",
+        [("summoner_puuid", 1), ("info.gameStartTimestamp", 1)],
+        {"name": "summoner_puuid_game_start"},
+    ),
+    # Ingestion looks up the stored copies of a match by its id
+    ("cached_match_data", [("metadata.matchId", 1)], {"name": "match_id"}),
+    ("discord_servers", [("guild_id", 1)], {"name": "guild_id"}),
+    # Used by the resolution cache to find riot ids and regions already stored on a guild
+    ("discord_servers", [("summoners.name", 1)], {"name": "summoners_name"}),
+    ("discord_servers", [("summoners.puuid", 1)], {"name": "summoners_puuid"}),
+    ("cached_match_data_timestamps", [("puuid", 1)], {"name": "puuid"}),
+    # Lets MongoDB delete expired resolution cache entries on its own
+    (
+        "summoner_resolution_cache",
+        [("expires_at", 1)],
+        {"name": "expires_at_ttl", "expireAfterSeconds": 0},
+    ),
+    # Lets MongoDB delete expired shared result cache entries on its own
+    ("result_cache", [("expires_at", 1)], {"name": "expires_at_ttl", "expireAfterSeconds": 0}),
+    ("summoner_daily_rollups", [("puuid", 1), ("day", 1)], {"name": "puuid_day"}),
+    # Stats read a summoner's match slices by start time, the unique index keeps one slice per (summoner, match)
+    ("match_slices", [("puuid", 1), ("game_start", 1)], {"name": "puuid_game_start"}),
+    ("match_slices", [("puuid", 1), ("match_id", 1)], {"name": "puuid_match_id", "unique": True}),
+    ("command_analytics", [("command_name", 1)], {"name": "command_name"}),
+]
+
+
+# Creates any declared index that does not exist yet, then verifies and reports on every collection
+# Safe to run on every startup, existing indexes are left untouched
+async def ensure_indexes():
+    for collection_name, keys, options in INDEXES:
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        if any(index["key"] == keys for index in existing.values()):
+            continue
+
+        try:
+            name = await collection.create_index(keys, **options)
+            print(f"Created index '{name}' on {collection_name}.")
+        except OperationFailure as e:
+            print(f"Failed to create index {keys} on {collection_name}: {e}")
+
+    report = await verify_indexes()
+    for collection_name, keys in report["missing"]:
+        print(f"Missing index {keys} on {collection_name}.")
+    for collection_name, name in report["undeclared"]:
+        print(f"Index '{name}' on {collection_name} is not declared in the schema.")
+    for collection_name, name in report["unused"]:
+        print(f"Index '{name}' on {collection_name} has not been used since the server started.")
+
+    return report
+
+
+# Compares the indexes in the database with the declared ones
+# Returns missing declared indexes, undeclared indexes and indexes with no recorded use ($indexStats)
+async def verify_indexes():
+    report = {"missing": [], "undeclared": [], "unused": []}
+    declared = {}
+    for collection_name, keys, options in INDEXES:
+        declared.setdefault(collection_name, []).append(keys)
+
+    for collection_name, declared_keys in declared.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        existing_keys = [index["key"] for index in existing.values()]
+
+        for keys in declared_keys:
+            if keys not in existing_keys:
+                report["missing"].append((collection_name, keys))
+
+        for name, index in existing.items():
+            if name != "_id_" and index["key"] not in declared_keys:
+                report["undeclared"].append((collection_name, name))
+
+        try:
+            index_stats = await collection.aggregate([{"$indexStats": {}}]).to_list(length=None)
+        except OperationFailure as e:
+            print(f"Could not read index usage for {collection_name}: {e}")
+            continue
+
+        for stats in index_stats:
+            if stats["name"] != "_id_" and stats["accesses"]["ops"] == 0:
+                report["unused"].append((collection_name, stats["name"]))
+
+    return report
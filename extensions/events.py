@@ -3,7 +3,8 @@ from config import ENVIRONMENT
 import discord
 from discord.ext import commands
 
-from data.mongo import update_guild_count, add_guild, update_command_analytics
+from data.analytics import analytics
+from data.mongo import update_guild_count, add_guild
 from data.topgg import update_stats
 from utils.logger import guild_join, guild_leave
 
@@ -38,7 +39,14 @@ class Events(commands.Cog):
         if interaction.type == discord.InteractionType.application_command:
             print(f"\n[{interaction.guild}]  [{interaction.user}]  [/{interaction.command.qualified_name}]")
             command_name = interaction.command.qualified_name.replace(" ", "_")
-            await update_command_analytics(command=command_name)
+            # Counted in memory, written in batches by the analytics flush
+            analytics.record(command_name, interaction.guild_id)
+
+    @commands.Cog.listener()
+    async def on_app_command_completion(self, interaction, command):
+        command_name = command.qualified_name.replace(" ", "_")
+        latency = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+        analytics.observe_latency(command_name, latency)
 
 async def setup(bot: commands.Bot):
     await bot.add_cog(Events(bot))
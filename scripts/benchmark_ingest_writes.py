@@ -0,0 +1,90 @@
+import argparse
+import asyncio
+import time
+
+from config import MATCH_STORAGE
+from data.bulk_writer import BulkWriter
+from data.database import DATABASE_NAME, client, db
+from data.matches import canonical_match_update, legacy_match_update, match_slice_update
+from data.schema import ensure_indexes
+from tests.corpus import synthetic_matches, synthetic_puuids
+
+# Compares the documents/second of ingest writes sent one operation per round trip with BulkWriter batches
+# Writes the same operations as data.matches.buffer_matches for the MATCH_STORAGE setting, on synthetic matches
+# Needs MONGO_DB_URI and a dedicated MONGO_DB_NAME, the database is dropped afterwards unless --keep
+# Run from the repository root: MONGO_DB_NAME=scuttle_bench python -m scripts.benchmark_ingest_writes
+
+COLLECTION_NAMES = ["cached_match_data", "matches", "match_slices"]
+
+
+# Returns the write operations of each match, as lists of (collection name, operation)
+def match_operations(matches, tracked_puuids):
+    tracked_puuids = set(tracked_puuids)
+    all_operations = []
+    for match in matches:
+        owners = [puuid for puuid in match["metadata"]["participants"] if puuid in tracked_puuids]
+        operations = []
+        if MATCH_STORAGE != "slices":
+            operations.extend(("cached_match_data", legacy_match_update(match, owner)) for owner in owners)
+        if MATCH_STORAGE != "legacy":
+            operations.append(("matches", canonical_match_update(match)))
+            operations.extend(("match_slices", match_slice_update(match, owner)) for owner in owners)
+        all_operations.append([(name, operation) for name, operation in operations if operation is not None])
+    return all_operations
+
+
+async def reset():
+    for collection_name in COLLECTION_NAMES:
+        await db[collection_name].delete_many({})
+
+
+# Writes every operation with its own round trip, like ingestion did before BulkWriter
+async def write_per_operation(all_operations):
+    for operations in all_operations:
+        for collection_name, operation in operations:
+            await db[collection_name].bulk_write([operation])
+
+
+# Writes the operations through a BulkWriter flushing every batch_size operations, like match_writer
+async def write_batched(all_operations, batch_size):
+    writer = BulkWriter("benchmark_writer", COLLECTION_NAMES, max_operations=batch_size, max_delay=60)
+    for operations in all_operations:
+        for collection_name, operation in operations:
+            writer.add(collection_name, [operation])
+        await writer.flush_if_full()
+    await writer.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-operation ingest writes against BulkWriter batches.")
+    parser.add_argument("--matches", type=int, default=2000)
+    parser.add_argument("--summoners", type=int, default=50, help="Tracked summoners the matches are stored for")
+    parser.add_argument("--batch-sizes", default="100,500,1000")
+    parser.add_argument("--keep", action="store_true", help="Keep the seeded database")
+    args = parser.parse_args()
+
+    if DATABASE_NAME == "league_discord_bot":
+        raise SystemExit("Set MONGO_DB_NAME to a dedicated database, this script replaces its match data.")
+
+    puuids = synthetic_puuids(args.summoners * 3)
+    all_operations = match_operations(synthetic_matches(args.matches, puuids), puuids[:args.summoners])
+    documents = sum(len(operations) for operations in all_operations)
+    print(f"{args.matches} matches, {documents} writes ({MATCH_STORAGE} storage) into {DATABASE_NAME}.")
+
+    runs = [("per operation", write_per_operation, ())]
+    runs += [(f"batches of {size}", write_batched, (int(size),)) for size in args.batch_sizes.split(",")]
+    try:
+        await ensure_indexes()
+        for label, write, write_args in runs:
+            await reset()
+            started = time.perf_counter()
+            await write(all_operations, *write_args)
+            seconds = time.perf_counter() - started
+            print(f"{label}: {seconds:.2f}s, {documents / seconds:.0f} documents/s")
+    finally:
+        if not args.keep:
+            await client.drop_database(DATABASE_NAME)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
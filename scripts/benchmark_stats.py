@@ -0,0 +1,78 @@
+import argparse
+import timeit
+
+from tests.corpus import summoner_matches, synthetic_matches, synthetic_puuids
+from utils.stats import (
+    calculate,
+    calculate_batch,
+    calculate_participants_batch,
+    calculate_vectorized,
+    find_participant,
+    finalize,
+    sum_participants,
+)
+
+# Times the Python and vectorized stats engines on synthetic matches
+# Run from the repository root: python -m scripts.benchmark_stats [--iterations N]
+
+
+# Best of five runs, the machine's other work only ever makes a run slower
+def _time(function, iterations):
+    return min(timeit.repeat(function, number=iterations, repeat=5)) / iterations
+
+
+def _format(seconds):
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.0f}us"
+    return f"{seconds * 1e3:.2f}ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the stats engines on synthetic matches.")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    # One summoner plays every match
+    for count in (10, 100, 1000):
+        matches = synthetic_matches(count, synthetic_puuids(10), seed=count)
+        summoner_puuid = matches[0]["metadata"]["participants"][0]
+        matches = summoner_matches(matches, summoner_puuid)
+        python_seconds = _time(lambda: calculate(summoner_puuid, matches), args.iterations)
+        numpy_seconds = _time(lambda: calculate_vectorized(summoner_puuid, matches), args.iterations)
+        print(
+            f"{len(matches):>5} matches, 1 summoner: python {_format(python_seconds)}, "
+            f"numpy {_format(numpy_seconds)} ({python_seconds / numpy_seconds:.2f}x)"
+        )
+
+    # A guild report, every member's stats at once
+    for members in (10, 50):
+        puuids = synthetic_puuids(members * 3)
+        matches = synthetic_matches(members * 100, puuids, seed=members)
+        summoners_matches = [(puuid, summoner_matches(matches, puuid)) for puuid in puuids[:members]]
+        python_seconds = _time(
+            lambda: [calculate(puuid, puuid_matches) for puuid, puuid_matches in summoners_matches],
+            max(1, args.iterations // 10),
+        )
+        numpy_seconds = _time(lambda: calculate_batch(summoners_matches), max(1, args.iterations // 10))
+        print(
+            f"{members:>5} summoners, {len(matches)} matches: python {_format(python_seconds)}, "
+            f"numpy batch {_format(numpy_seconds)} ({python_seconds / numpy_seconds:.2f}x)"
+        )
+
+        # Guild reports group the participant entries by summoner first, see calculate_guild_stats_by_range
+        participant_groups = [
+            [find_participant(match, puuid) for match in puuid_matches] for puuid, puuid_matches in summoners_matches
+        ]
+        python_seconds = _time(
+            lambda: [finalize(sum_participants(participants)) for participants in participant_groups],
+            max(1, args.iterations // 10),
+        )
+        numpy_seconds = _time(lambda: calculate_participants_batch(participant_groups), max(1, args.iterations // 10))
+        print(
+            f"{members:>5} summoners, participants only: python {_format(python_seconds)}, "
+            f"numpy batch {_format(numpy_seconds)} ({python_seconds / numpy_seconds:.2f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import asyncio
+import time
+
+from data.database import DATABASE_NAME, client, db
+from data.mongo import calculate_guild_stats_by_range
+from data.schema import ensure_indexes
+import utils.metrics as metrics
+from utils.loop_monitor import start_event_loop_monitor
+from utils.stats import build_participant_index
+from tests.corpus import cached_match_documents, synthetic_matches, synthetic_puuids
+
+# Measures how much a large guild report blocks the event loop
+# Seeds a database with synthetic matches, then calculates the report's stats with every engine
+# while the event loop lag monitor runs, and prints the report time and the lag's p50/p95/max per engine
+# Needs MONGO_DB_URI and a dedicated MONGO_DB_NAME, the seeded database is dropped afterwards unless --keep
+# Run from the repository root: MONGO_DB_NAME=scuttle_lag python -m scripts.measure_report_lag
+
+# Lag histogram buckets, finer than the default ones since most samples are a few milliseconds
+LAG_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5)
+
+
+async def seed(summoners, matches, day_range):
+    puuids = synthetic_puuids(summoners * 3)
+    documents = cached_match_documents(synthetic_matches(matches, puuids, days=day_range), puuids[:summoners])
+    for document in documents:
+        document["participant_index"] = build_participant_index(document)
+
+    await db.cached_match_data.delete_many({})
+    for start in range(0, len(documents), 1000):
+        await db.cached_match_data.insert_many(documents[start:start + 1000], ordered=False)
+    await ensure_indexes()
+    print(f"Seeded {len(documents)} cached matches for {summoners} summoners in {DATABASE_NAME}.")
+    return puuids[:summoners]
+
+
+# Runs the reports with the lag monitor attached, returns the seconds each report took
+async def measure(summoner_puuids, day_range, engine, runs, concurrency, interval, warn_threshold):
+    metrics.histograms["event_loop.lag"] = metrics.Histogram(LAG_BUCKETS)
+    monitor = start_event_loop_monitor(interval, warn_threshold)
+
+    durations = []
+
+    async def report():
+        started = time.perf_counter()
+        await calculate_guild_stats_by_range(summoner_puuids, range=day_range, engine=engine)
+        durations.append(time.perf_counter() - started)
+
+    try:
+        for _ in range(runs):
+            await asyncio.gather(*[report() for _ in range(concurrency)])
+        # Lets the monitor record the sample covering the end of the last report
+        await asyncio.sleep(interval * 2)
+    finally:
+        monitor.cancel()
+    return durations
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Measure event loop lag while building large guild reports.")
+    parser.add_argument("--summoners", type=int, default=50)
+    parser.add_argument("--matches", type=int, default=5000)
+    parser.add_argument("--range", type=int, default=30)
+    parser.add_argument("--engines", default="python,numpy,rollup")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=1, help="Reports built at the same time per run")
+    parser.add_argument("--interval", type=float, default=0.01, help="Lag monitor sampling interval in seconds")
+    parser.add_argument("--keep", action="store_true", help="Keep the seeded database")
+    args = parser.parse_args()
+
+    if DATABASE_NAME == "league_discord_bot":
+        raise SystemExit("Set MONGO_DB_NAME to a dedicated database, this script replaces its match data.")
+
+    try:
+        summoner_puuids = await seed(args.summoners, args.matches, args.range)
+        for engine in args.engines.split(","):
+            durations = await measure(
+                summoner_puuids, args.range, engine, args.runs, args.concurrency, args.interval, warn_threshold=0.25
+            )
+            lag = metrics.histograms["event_loop.lag"].summary()
+            print(
+                f"{engine}: report avg {sum(durations) / len(durations):.3f}s max {max(durations):.3f}s, "
+                f"loop lag p50 <= {lag['p50']}s p95 <= {lag['p95']}s max {lag['max']:.3f}s ({lag['count']} samples)"
+            )
+    finally:
+        if not args.keep:
+            await client.drop_database(DATABASE_NAME)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,30 @@
+# tasks/ingestion.py
+
+from discord.ext import commands, tasks
+
+from config import INGESTION_TICK_SECONDS
+from data.ingestion import run_ingestion_cycle
+
+class IngestionTasks(commands.Cog):
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.ingest_matches.start()  # Start the task when the cog is loaded
+
+    def cog_unload(self):
+        self.ingest_matches.cancel()
+
+    # Refreshes the matches of the most urgent summoners in the ingestion queue
+    @tasks.loop(seconds=INGESTION_TICK_SECONDS)
+    async def ingest_matches(self):
+        try:
+            await run_ingestion_cycle()
+        except Exception as e:
+            print(f"Error during match ingestion: {e}")
+
+    @ingest_matches.before_loop
+    async def before_ingest_matches(self):
+        print("Waiting for bot to be ready...")
+        await self.bot.wait_until_ready()  # Wait until the bot is ready before starting the loop
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(IngestionTasks(bot))
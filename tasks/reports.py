@@ -1,83 +1,171 @@
 # tasks/reports.py
 
+import asyncio
+import random
+import time
 import discord
 from discord.ext import commands, tasks
 from datetime import datetime
 
-from data.mongo import get_main_channel, fetch_report_by_day_range, get_summoners, is_summoner_cached
+from data.mongo import get_main_channel
+from data.reports import compute_guild_report, get_report_guild_ids, get_report_snapshot, precompute_guild_report
+from config import REPORT_CONCURRENCY, REPORT_PRECOMPUTE_LEAD_MINUTES, WEEKLY_REPORT_WEEKDAY, WEEKLY_REPORT_HOUR
+import utils.metrics as metrics
+from utils.send_limiter import send_limiter
+
+# Histogram buckets for how long after the weekly dispatch started a guild's report was done, in seconds
+COMPLETION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+# Precomputing stops this many seconds before the reports are sent
+PRECOMPUTE_MARGIN_SECONDS = 300
 
 class ReportTasks(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.report_automatic.start()  # Start the task when the cog is loaded
+        self.precompute_reports.start()
 
     @tasks.loop(minutes=1)
     async def report_automatic(self):
         now = datetime.now()
 
-        # Check if it is 4:00 pm EST on a Sunday
-        if now.weekday() == 6 and now.hour == 20 and now.minute == 00:
-            for guild in self.bot.guilds:
-                channel_id = await get_main_channel(guild.id)
-
-                print(f"\n[{guild.name}]  [Automated Report]  [Weekly]")
-
-                if channel_id:
-                    channel = self.bot.get_channel(channel_id)
-                    if channel:
-                        try:
-                            await channel.send("*Loading automated weekly report...*")
-                            stats = await fetch_report_by_day_range(guild.id, range=7)
-                            if stats:
-                                summoners_not_cached = []
-                                summoners = await get_summoners(guild.id)
-
-                                if summoners:
-                                    for summoner in summoners:
-                                        is_cached = await is_summoner_cached(puuid=summoner["puuid"])
-                                        if not is_cached:
-                                            summoners_not_cached.append(summoner["name"])
-
-                                    summoners_names = [summoner["name"] for summoner in summoners]
-                                    embed = discord.Embed(
-                                        title=f"📈 Server {guild.name}'s stats for the past 7 days.",
-                                        description="This is a general overview showing which summoner had the highest value for each stat in the past 7 days for Ranked Solo Queue.",
-                                        color=discord.Color.green(),
-                                    )
-                                    for stat in stats:
-                                        embed.add_field(name=stat["Key"], value=f"{stat['Max Value']} - {stat['Name']}", inline=True)
-
-                                    # Summoners
-                                    summoners_embed = discord.Embed(
-                                        title="🏆 Summoners Compared:",
-                                        description="This is a list of all the summoners in your Guild whose stats have been compared.",
-                                        color=discord.Color.green(),
-                                    )
-                                    for name in summoners_names:
-                                        if name not in summoners_not_cached:
-                                            summoners_embed.add_field(name="", value=name, inline=True)
-
-                                    embeds_arr = [embed, summoners_embed]
-
-                                    await channel.send(embeds=embeds_arr)
-                            else:
-                                embed = discord.Embed(
-                                    title="❌ Automatic Weekly Report",
-                                    description="Error fetching automatic weekly report.",
-                                    color=discord.Color.green(),
-                                )
-                                await channel.send(embed=embed)
-                        except Exception as e:
-                            print(f"Error sending message to channel {channel.id}: {e}")
-                    else:
-                        print("Channel not found.")
-                else:
-                    print(f"{guild.name} does not have a main channel set.")
+        # Check if it is 4:00 pm EST on a Sunday (by default)
+        if now.weekday() == WEEKLY_REPORT_WEEKDAY and now.hour == WEEKLY_REPORT_HOUR and now.minute == 00:
+            await self.dispatch_weekly_reports()
+
+    # Precomputes the weekly reports ahead of the send window
+    @tasks.loop(minutes=1)
+    async def precompute_reports(self):
+        now = datetime.now()
+        minutes_until_report = WEEKLY_REPORT_HOUR * 60 - (now.hour * 60 + now.minute)
+
+        if now.weekday() == WEEKLY_REPORT_WEEKDAY and minutes_until_report == REPORT_PRECOMPUTE_LEAD_MINUTES:
+            await self.precompute_weekly_reports()
+
+    # Computes and stores the weekly report of every guild with a main channel
+    # Each guild starts at a random time in the precompute window so the queries are spread over it instead of
+    # all landing at once, at most REPORT_CONCURRENCY run at the same time
+    async def precompute_weekly_reports(self):
+        started = time.monotonic()
+        bot_guild_ids = {guild.id for guild in self.bot.guilds}
+        guild_ids = [guild_id for guild_id in await get_report_guild_ids() if guild_id in bot_guild_ids]
+        window = max(REPORT_PRECOMPUTE_LEAD_MINUTES * 60 - PRECOMPUTE_MARGIN_SECONDS, 0)
+        schedule = sorted((random.uniform(0, window), guild_id) for guild_id in guild_ids)
+        semaphore = asyncio.Semaphore(REPORT_CONCURRENCY)
+
+        async def precompute(guild_id):
+            async with semaphore:
+                try:
+                    await precompute_guild_report(guild_id, range=7)
+                    metrics.incr("reports.precomputed")
+                except Exception as e:
+                    print(f"Error precomputing weekly report for guild {guild_id}: {e}")
+                    metrics.incr("reports.precompute_failures")
+
+        print(f"Precomputing {len(schedule)} weekly reports over the next {window} seconds...")
+        pending = []
+        for offset, guild_id in schedule:
+            await asyncio.sleep(max(started + offset - time.monotonic(), 0))
+            pending.append(asyncio.create_task(precompute(guild_id)))
+        await asyncio.gather(*pending)
+        print(f"Precomputed weekly reports in {time.monotonic() - started:.2f} seconds.")
+
+    # Sends every guild's weekly report, REPORT_CONCURRENCY guilds at a time
+    # The worker count also bounds the report queries running against MongoDB, sends go through the shared send limiter
+    # Records "reports.sent", "reports.failed" and "reports.skipped", the time spent on each guild in "reports.guild_seconds"
+    # and how long after the dispatch started each guild's report was done in "reports.completion_seconds"
+    async def dispatch_weekly_reports(self):
+        started = time.perf_counter()
+        queue = asyncio.Queue()
+        for guild in self.bot.guilds:
+            queue.put_nowait(guild)
+        outcomes = {"sent": 0, "failed": 0, "skipped": 0}
+
+        async def worker():
+            while not queue.empty():
+                guild = queue.get_nowait()
+                guild_started = time.perf_counter()
+                try:
+                    outcome = await self.send_weekly_report(guild)
+                except Exception as e:
+                    print(f"Error sending weekly report to guild {guild.name}: {e}")
+                    outcome = "failed"
+
+                outcomes[outcome] += 1
+                metrics.incr(f"reports.{outcome}")
+                if outcome != "skipped":
+                    now = time.perf_counter()
+                    metrics.observe("reports.guild_seconds", now - guild_started)
+                    metrics.observe("reports.completion_seconds", now - started, COMPLETION_BUCKETS)
+
+        await asyncio.gather(*(worker() for _ in range(min(REPORT_CONCURRENCY, queue.qsize()))))
+        print(f"Dispatched weekly reports in {time.perf_counter() - started:.2f} seconds: {outcomes}")
+
+    # Computes and sends a guild's weekly report to its main channel
+    # Returns "sent", "failed" or "skipped" when the guild has no main channel
+    async def send_weekly_report(self, guild):
+        channel_id = await get_main_channel(guild.id)
+
+        print(f"\n[{guild.name}]  [Automated Report]  [Weekly]")
+
+        if not channel_id:
+            print(f"{guild.name} does not have a main channel set.")
+            return "skipped"
+
+        channel = self.bot.get_channel(channel_id)
+        if not channel:
+            print("Channel not found.")
+            return "failed"
+
+        try:
+            # Precomputed reports are only rendered, the others are computed now
+            report = await get_report_snapshot(guild.id, range=7)
+            if report is None:
+                await send_limiter.send(channel, "*Loading automated weekly report...*")
+                report = await compute_guild_report(guild.id, range=7)
+
+            if report:
+                embed = discord.Embed(
+                    title=f"📈 Server {guild.name}'s stats for the past 7 days.",
+                    description="This is a general overview showing which summoner had the highest value for each stat in the past 7 days for Ranked Solo Queue.",
+                    color=discord.Color.green(),
+                )
+                for stat in report["stats"]:
+                    embed.add_field(name=stat["Key"], value=f"{stat['Max Value']} - {stat['Name']}", inline=True)
+
+                # Summoners
+                summoners_embed = discord.Embed(
+                    title="🏆 Summoners Compared:",
+                    description="This is a list of all the summoners in your Guild whose stats have been compared.",
+                    color=discord.Color.green(),
+                )
+                for name in report["summoners"]:
+                    if name not in report["summoners_not_cached"]:
+                        summoners_embed.add_field(name="", value=name, inline=True)
+
+                embeds_arr = [embed, summoners_embed]
+
+                await send_limiter.send(channel, embeds=embeds_arr)
+                return "sent"
+            else:
+                embed = discord.Embed(
+                    title="❌ Automatic Weekly Report",
+                    description="Error fetching automatic weekly report.",
+                    color=discord.Color.green(),
+                )
+                await send_limiter.send(channel, embed=embed)
+                return "failed"
+        except Exception as e:
+            print(f"Error sending message to channel {channel.id}: {e}")
+            return "failed"
 
     @report_automatic.before_loop
     async def before_report_automatic(self):
         print("Waiting for bot to be ready...")
         await self.bot.wait_until_ready()  # Wait until the bot is ready before starting the loop
 
+    @precompute_reports.before_loop
+    async def before_precompute_reports(self):
+        await self.bot.wait_until_ready()
+
 async def setup(bot: commands.Bot):
     await bot.add_cog(ReportTasks(bot))
@@ -0,0 +1,80 @@
+import random
+import time
+
+# Synthetic matches for the tests and scripts, shaped like the Riot match payloads stored in cached_match_data
+# Every stat field shows up as an int, a float, a boolean or missing, so the engines' defaults are exercised too
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+def synthetic_puuids(count):
+    return [f"puuid-{index}" for index in range(count)]
+
+
+# Returns a participant entry with every stat field, some of them randomly left out
+def synthetic_participant(puuid, rng):
+    participant = {
+        "puuid": puuid,
+        "kills": rng.randint(0, 20),
+        "deaths": rng.randint(0, 15),
+        "assists": rng.randint(0, 30),
+        "visionScore": rng.randint(0, 80),
+        "totalDamageDealtToChampions": rng.randint(1000, 60000),
+        "assistMePings": rng.randint(0, 10),
+        "enemyMissingPings": rng.randint(0, 10),
+        "gameEndedInSurrender": rng.random() < 0.2,
+        "championName": rng.choice(["Ahri", "Garen", "Jinx", "Lee Sin", "Thresh"]),
+        "challenges": {
+            "kda": rng.random() * 8,
+            "soloKills": rng.randint(0, 4),
+            "teamDamagePercentage": rng.random(),
+            "killParticipation": rng.random(),
+            "goldPerMinute": rng.random() * 600,
+            "damagePerMinute": rng.random() * 1200,
+            "controlWardsPlaced": rng.randint(0, 6),
+            "abilityUses": rng.randint(50, 500),
+            "scuttleCrabKills": rng.randint(0, 3),
+        },
+    }
+    if rng.random() < 0.05:
+        del participant["challenges"]
+    elif rng.random() < 0.1:
+        del participant["challenges"][rng.choice(list(participant["challenges"]))]
+    if rng.random() < 0.05:
+        del participant["assistMePings"]
+    return participant
+
+
+# Returns count matches of ten players each, drawn from puuids and started in the last days days
+def synthetic_matches(count, puuids, days=35, seed=0):
+    rng = random.Random(seed)
+    now = int(time.time() * 1000)
+    matches = []
+    for index in range(count):
+        players = rng.sample(puuids, min(10, len(puuids)))
+        matches.append(
+            {
+                "metadata": {"matchId": f"TEST_{seed}_{index}", "participants": players},
+                "info": {
+                    "gameStartTimestamp": now - rng.randint(0, days * DAY_MS),
+                    "participants": [synthetic_participant(puuid, rng) for puuid in players],
+                },
+            }
+        )
+    return matches
+
+
+# Returns the cached_match_data documents of the matches, one per match and tracked summoner who played in it
+def cached_match_documents(matches, tracked_puuids):
+    tracked_puuids = set(tracked_puuids)
+    return [
+        {**match, "summoner_puuid": puuid}
+        for match in matches
+        for puuid in match["metadata"]["participants"]
+        if puuid in tracked_puuids
+    ]
+
+
+# Returns the matches a summoner played in
+def summoner_matches(matches, summoner_puuid):
+    return [match for match in matches if summoner_puuid in match["metadata"]["participants"]]
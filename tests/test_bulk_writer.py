@@ -0,0 +1,84 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import data.bulk_writer as bulk_writer
+from data.bulk_writer import BulkWriter
+
+
+# Stands in for a Motor collection, bulk_write takes write_seconds and records the operations it wrote
+class SlowCollection:
+    def __init__(self, name, write_seconds):
+        self.name = name
+        self.write_seconds = write_seconds
+        self.written = []
+
+    async def bulk_write(self, operations, ordered=True):
+        await asyncio.sleep(self.write_seconds)
+        self.written.extend(operations)
+
+
+class BulkWriterTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.collection = SlowCollection("matches", write_seconds=0.2)
+        patcher = mock.patch.object(bulk_writer, "db", {"matches": self.collection})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_flushes_after_max_delay(self):
+        writer = BulkWriter("test_writer", ["matches"], max_operations=100, max_delay=0.05)
+        writer.add("matches", [1, 2])
+
+        await asyncio.sleep(0.4)
+        self.assertEqual(self.collection.written, [1, 2])
+        self.assertEqual(len(writer), 0)
+
+    async def test_operations_added_during_a_timed_flush_are_flushed(self):
+        writer = BulkWriter("test_writer", ["matches"], max_operations=100, max_delay=0.05)
+        writer.add("matches", [1])
+
+        # The timed flush is waiting on bulk_write when the next operation arrives
+        await asyncio.sleep(0.1)
+        writer.add("matches", [2])
+
+        await asyncio.sleep(0.6)
+        self.assertEqual(self.collection.written, [1, 2])
+        self.assertEqual(len(writer), 0)
+
+    async def test_after_flush_runs_once_the_operations_are_written(self):
+        writer = BulkWriter("test_writer", ["matches"], max_operations=100, max_delay=60)
+        written_when_called = []
+        writer.add("matches", [1])
+        writer.after_flush(lambda: written_when_called.append(list(self.collection.written)))
+
+        await writer.flush_if_full()
+        self.assertEqual(written_when_called, [])
+
+        await writer.flush()
+        self.assertEqual(written_when_called, [[1]])
+
+    async def test_after_flush_skipped_when_the_write_fails(self):
+        self.collection.bulk_write = mock.AsyncMock(side_effect=RuntimeError("write failed"))
+        writer = BulkWriter("test_writer", ["matches"], max_operations=100, max_delay=60)
+        called = []
+        writer.add("matches", [1])
+        writer.after_flush(lambda: called.append(True))
+
+        with self.assertRaises(RuntimeError):
+            await writer.flush()
+        self.assertEqual(called, [])
+
+    async def test_flush_if_full(self):
+        writer = BulkWriter("test_writer", ["matches"], max_operations=2, max_delay=60)
+        writer.add("matches", [1])
+        await writer.flush_if_full()
+        self.assertEqual(self.collection.written, [])
+
+        writer.add("matches", [2])
+        await writer.flush_if_full()
+        self.assertEqual(self.collection.written, [1, 2])
+        await writer.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
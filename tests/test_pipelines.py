@@ -0,0 +1,107 @@
+import os
+import unittest
+import uuid
+
+from data.pipelines import (
+    guild_matches_pipeline,
+    slice_stats_pipeline,
+    summoner_matches_pipeline,
+    summoner_stats_pipeline,
+)
+from tests.corpus import DAY_MS, cached_match_documents, summoner_matches, synthetic_matches, synthetic_puuids
+from utils.stats import FIELD_STATS, MATCHES_LABEL, build_participant_index, calculate, empty_stats, finalize
+
+# Checks the aggregation pipelines against the Python engine on a real MongoDB
+# Only runs with TEST_MONGO_DB_URI set, every run uses a throwaway database that is dropped afterwards
+MONGO_URI = os.getenv("TEST_MONGO_DB_URI")
+
+
+@unittest.skipUnless(MONGO_URI, "TEST_MONGO_DB_URI is not set")
+class PipelineParityTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        from pymongo import MongoClient
+
+        cls.client = MongoClient(MONGO_URI)
+        cls.db = cls.client[f"scuttle_test_{uuid.uuid4().hex[:8]}"]
+
+        cls.puuids = synthetic_puuids(30)
+        cls.tracked = cls.puuids[:12]
+        cls.matches = synthetic_matches(400, cls.puuids)
+        # Half the documents have a participant_index, so both ways of finding a summoner's entry are checked
+        documents = cached_match_documents(cls.matches, cls.tracked)
+        for document in documents[::2]:
+            document["participant_index"] = build_participant_index(document)
+        cls.db.cached_match_data.insert_many(documents)
+        cls.db.match_slices.insert_many(
+            [
+                {
+                    "puuid": participant["puuid"],
+                    "match_id": match["metadata"]["matchId"],
+                    "game_start": match["info"]["gameStartTimestamp"],
+                    "participant": participant,
+                }
+                for match in cls.matches
+                for participant in match["info"]["participants"]
+                if participant["puuid"] in cls.tracked
+            ]
+        )
+        cls.lower_range_epoch = max(match["info"]["gameStartTimestamp"] for match in cls.matches) - 7 * DAY_MS
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.client.drop_database(cls.db.name)
+        cls.client.close()
+
+    # Turns a stats pipeline's result into stats, like aggregate_summoner_stats_by_range
+    def finalize_result(self, results):
+        totals = empty_stats()
+        if results:
+            totals[MATCHES_LABEL] = results[0]["matches"]
+            for stat in FIELD_STATS:
+                totals[stat.label] = results[0][stat.name]
+        return finalize(totals)
+
+    def expected_stats(self, summoner_puuid):
+        matches = [
+            match
+            for match in summoner_matches(self.matches, summoner_puuid)
+            if match["info"]["gameStartTimestamp"] >= self.lower_range_epoch
+        ]
+        return calculate(summoner_puuid, matches)
+
+    def test_summoner_stats_pipeline(self):
+        for summoner_puuid in self.tracked:
+            pipeline = summoner_stats_pipeline(summoner_puuid, self.lower_range_epoch)
+            results = list(self.db.cached_match_data.aggregate(pipeline))
+            self.assertEqual(self.expected_stats(summoner_puuid), self.finalize_result(results), summoner_puuid)
+
+    def test_summoner_matches_pipeline(self):
+        for summoner_puuid in self.tracked:
+            pipeline = summoner_matches_pipeline(summoner_puuid, self.lower_range_epoch)
+            matches = list(self.db.cached_match_data.aggregate(pipeline))
+            stats = calculate(summoner_puuid, matches) if matches else empty_stats()
+            self.assertEqual(self.expected_stats(summoner_puuid), stats, summoner_puuid)
+
+    def test_slice_stats_pipeline(self):
+        for summoner_puuid in self.tracked:
+            pipeline = slice_stats_pipeline(summoner_puuid, self.lower_range_epoch)
+            results = list(self.db.match_slices.aggregate(pipeline))
+            self.assertEqual(self.expected_stats(summoner_puuid), self.finalize_result(results), summoner_puuid)
+
+    def test_guild_matches_pipeline(self):
+        pipeline = guild_matches_pipeline(self.tracked, self.lower_range_epoch)
+        guild_matches = list(self.db.cached_match_data.aggregate(pipeline))
+
+        for summoner_puuid in self.tracked:
+            matches = [
+                {"info": {"participants": match["participants"]}}
+                for match in guild_matches
+                if summoner_puuid in match["owners"]
+            ]
+            stats = calculate(summoner_puuid, matches) if matches else empty_stats()
+            self.assertEqual(self.expected_stats(summoner_puuid), stats, summoner_puuid)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+
+from tests.corpus import summoner_matches, synthetic_matches, synthetic_puuids
+from utils.stats import (
+    MATCHES_LABEL,
+    STATS,
+    calculate,
+    calculate_batch,
+    calculate_vectorized,
+    empty_stats,
+    find_participant,
+    finalize,
+    merge_totals,
+    sum_participants,
+)
+
+# The stats engines must return the same dictionary, value types included, for the same matches
+
+
+class StatsEngineParityTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.puuids = synthetic_puuids(30)
+        cls.matches = synthetic_matches(600, cls.puuids)
+
+    def participants(self, summoner_puuid, matches):
+        return [find_participant(match, summoner_puuid) for match in matches]
+
+    def test_engines_agree(self):
+        for summoner_puuid in self.puuids:
+            matches = summoner_matches(self.matches, summoner_puuid)
+            expected = calculate(summoner_puuid, matches)
+            totals = finalize(sum_participants(self.participants(summoner_puuid, matches)))
+            vectorized = calculate_vectorized(summoner_puuid, matches)
+
+            self.assertEqual(expected, vectorized, summoner_puuid)
+            self.assertEqual(expected, totals, summoner_puuid)
+            for label, value in expected.items():
+                self.assertIs(type(value), type(vectorized[label]), (summoner_puuid, label))
+
+    def test_batch_matches_single_summoners(self):
+        summoners_matches = [
+            (summoner_puuid, summoner_matches(self.matches, summoner_puuid)) for summoner_puuid in self.puuids
+        ]
+        summoners_matches.append(("puuid-unknown", []))
+
+        batch = calculate_batch(summoners_matches)
+        for (summoner_puuid, matches), stats in zip(summoners_matches, batch):
+            expected = calculate(summoner_puuid, matches) if matches else empty_stats()
+            self.assertEqual(expected, stats, summoner_puuid)
+
+    def test_merged_totals_match_one_pass(self):
+        summoner_puuid = self.puuids[0]
+        participants = self.participants(summoner_puuid, summoner_matches(self.matches, summoner_puuid))
+        half = len(participants) // 2
+
+        merged = merge_totals(sum_participants(participants[:half]), sum_participants(participants[half:]))
+        self.assertEqual(finalize(sum_participants(participants)), finalize(merged))
+
+    def test_no_matches(self):
+        self.assertEqual(calculate("puuid-unknown", []), empty_stats())
+        self.assertEqual(calculate_vectorized("puuid-unknown", []), empty_stats())
+        self.assertEqual(finalize(sum_participants([])), empty_stats())
+
+    def test_surrenders_are_counted(self):
+        participants = [{"puuid": "p", "gameEndedInSurrender": True}, {"puuid": "p", "gameEndedInSurrender": False}]
+        matches = [{"info": {"participants": [participant]}} for participant in participants]
+        surrendered = next(stat.label for stat in STATS if stat.name == "games_surrendered")
+
+        self.assertEqual(calculate("p", matches)[surrendered], 1)
+        self.assertEqual(calculate_vectorized("p", matches)[surrendered], 1)
+        self.assertEqual(calculate("p", matches)[MATCHES_LABEL], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,129 @@
+import asyncio
 import discord
+from collections import deque
 from datetime import datetime
 import pytz
 from typing import List
 
-from config import GUILD_ERROR_CHANNEL_ID, GUILD_JOIN_CHANNEL_ID, GUILD_LEAVE_CHANNEL_ID, GUILD_LOGS_CHANNEL_ID
+from config import (
+    GUILD_ERROR_CHANNEL_ID,
+    GUILD_JOIN_CHANNEL_ID,
+    GUILD_LEAVE_CHANNEL_ID,
+    GUILD_LOGS_CHANNEL_ID,
+    LOG_SINK_COALESCE_SECONDS,
+    LOG_SINK_MAX_EMBEDS,
+)
+import utils.metrics as metrics
+from utils.send_limiter import send_limiter
+
+# Discord's limits for the embeds of a single message
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_EMBED_CHARACTERS_PER_MESSAGE = 6000
+
+
+# Background sink for the log channels, commands queue their logs and return instead of waiting on Discord
+# Embeds are sent in order, packed up to Discord's limits per message, after waiting LOG_SINK_COALESCE_SECONDS
+# for the rest of a burst. Sends go through the shared send limiter
+# At most LOG_SINK_MAX_EMBEDS embeds wait in the queue, logs arriving when it is full are dropped, counted in
+# "logger.dropped" and reported in the logs channel
+# Errors have their own queue, sent first and without waiting for the burst
+class LogSink:
+    def __init__(self, max_embeds, coalesce_seconds):
+        self.max_embeds = max_embeds
+        self.coalesce_seconds = coalesce_seconds
+        self.dropped = 0
+        self._queue = deque()  # (channel id, embed)
+        self._priority = deque()
+        self._added = asyncio.Event()
+        self._priority_added = asyncio.Event()
+        self._bot = None
+        self._task = None
+
+    # Queues embeds to be sent to a channel together, returns False when they were dropped
+    def put(self, bot, channel_id, embeds, priority=False):
+        self._bot = bot
+        if priority:
+            self._priority.extend((channel_id, embed) for embed in embeds)
+            self._priority_added.set()
+        elif len(self._queue) + len(embeds) > self.max_embeds:
+            self.dropped += 1
+            metrics.incr("logger.dropped")
+            return False
+        else:
+            self._queue.extend((channel_id, embed) for embed in embeds)
+
+        metrics.gauge("logger.queue_depth", len(self._queue) + len(self._priority))
+        self._added.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return True
+
+    async def _run(self):
+        while True:
+            await self._added.wait()
+            self._added.clear()
+            if not self._priority:
+                # Let the rest of a burst arrive, unless an error has to go out
+                self._priority_added.clear()
+                try:
+                    await asyncio.wait_for(self._priority_added.wait(), self.coalesce_seconds)
+                except asyncio.TimeoutError:
+                    pass
+            await self._drain()
+
+    async def _drain(self):
+        while self._priority or self._queue:
+            await self._send_next(self._priority if self._priority else self._queue)
+
+        if self.dropped:
+            embed = discord.Embed(
+                title="⚠️ Logs Dropped",
+                description=f"{self.dropped} command logs were dropped because the log queue was full.",
+                color=discord.Color.red(),
+            )
+            self.dropped = 0
+            await self._send(int(GUILD_LOGS_CHANNEL_ID), [embed])
+
+    # Sends the next message's worth of embeds queued for the same channel
+    async def _send_next(self, queue):
+        channel_id = queue[0][0]
+        embeds = []
+        characters = 0
+        while queue and queue[0][0] == channel_id and len(embeds) < MAX_EMBEDS_PER_MESSAGE:
+            embed = queue[0][1]
+            if embeds and characters + len(embed) > MAX_EMBED_CHARACTERS_PER_MESSAGE:
+                break
+            queue.popleft()
+            embeds.append(embed)
+            characters += len(embed)
+
+        metrics.gauge("logger.queue_depth", len(self._queue) + len(self._priority))
+        await self._send(channel_id, embeds)
+
+    async def _send(self, channel_id, embeds):
+        channel = self._bot.get_channel(channel_id) if self._bot else None
+        if not channel:
+            print(f"Failed to get the log channel {channel_id}.")
+            return
+
+        try:
+            await send_limiter.send(channel, embeds=embeds)
+            metrics.incr("logger.messages")
+            metrics.incr("logger.embeds", len(embeds))
+        except Exception as e:
+            print(f"Failed to send logs to Discord: {e}")
+
+    # Sends everything still queued and stops the sink, e.g. before the bot disconnects
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self._drain()
+
+
+# Sink shared by every log sent to the log channels
+log_sink = LogSink(LOG_SINK_MAX_EMBEDS, LOG_SINK_COALESCE_SECONDS)
+
 
 async def guild_join(bot, guild):
     try:
@@ -81,8 +201,8 @@ async def error(bot, interaction: discord.Interaction, error_stack, error_messag
             embed.add_field(name="Error User", value=f"`{interaction.user}` ({interaction.user.id})", inline=False)
             embed.add_field(name="Error Command Channel", value=f"`{interaction.channel}` ({interaction.channel_id})", inline=False)
 
-
-            await log_channel.send(embed=embed)
+            # Errors skip the queue of command logs
+            log_sink.put(bot, log_channel.id, [embed], priority=True)
         else:
             print(f"Failed to get the error log channel.")
     except Exception as e:
@@ -104,13 +224,14 @@ async def command(bot, interaction: discord.Interaction, output_embed: discord.E
             embed.add_field(name="Channel of Use", value=f"`{interaction.channel}` ({interaction.channel_id})", inline=False)
             embed.add_field(name="Command User", value=f"`{interaction.user}` ({interaction.user.id})", inline=False)
 
-            await log_channel.send(embed=embed)
-
+            embeds = [embed]
             if output_embed:
-                await log_channel.send(embed=output_embed)
-
+                embeds.append(output_embed)
             if output_embeds:
-                await log_channel.send(embeds=output_embeds)
+                embeds.extend(output_embeds)
+
+            # Sent in the background, packed with the logs of other commands
+            log_sink.put(bot, log_channel.id, embeds)
         else:
             print(f"Failed to get the log channel.")
     except Exception as e:
@@ -0,0 +1,24 @@
+import asyncio
+import time
+
+import utils.metrics as metrics
+
+
+# Measures event loop lag: how late a sleep wakes up compared to when it was scheduled
+# Anything that blocks the loop (synchronous I/O, heavy computation) shows up as lag for every shard
+# Lag samples are recorded in the "event_loop.lag" histogram and large stalls are logged
+async def monitor_event_loop_lag(interval=0.5, warn_threshold=0.25):
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0, time.perf_counter() - started - interval)
+
+        metrics.observe("event_loop.lag", lag)
+        if lag >= warn_threshold:
+            metrics.incr("event_loop.stalls")
+            print(f"Event loop was blocked for {lag:.3f} seconds.")
+
+
+# Starts the lag monitor as a background task on the running loop
+def start_event_loop_monitor(interval=0.5, warn_threshold=0.25):
+    return asyncio.create_task(monitor_event_loop_lag(interval, warn_threshold))
@@ -0,0 +1,75 @@
+import bisect
+from collections import defaultdict
+
+# Process-wide counters and histograms for the bot's internal performance numbers
+# Names are dotted strings, e.g. "riot.singleflight.deduped"
+
+# Default histogram bucket upper bounds, suited to latencies in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+counters = defaultdict(int)
+gauges = {}
+histograms = {}
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot counts values above the largest bucket
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    # Returns an approximate quantile, using the upper bound of the bucket it falls in
+    def quantile(self, q):
+        if self.count == 0:
+            return 0
+        target = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "avg": round(self.sum / self.count, 4) if self.count else 0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": self.max,
+        }
+
+
+# Increments a counter
+def incr(name, value=1):
+    counters[name] += value
+
+
+# Sets a gauge to its current value (e.g. a queue depth)
+def gauge(name, value):
+    gauges[name] = value
+
+
+# Records a value in a histogram, creating it with the given buckets on first use
+def observe(name, value, buckets=DEFAULT_BUCKETS):
+    histogram = histograms.get(name)
+    if histogram is None:
+        histogram = histograms[name] = Histogram(buckets)
+    histogram.observe(value)
+
+
+# Returns a plain dictionary of every metric recorded so far
+def snapshot():
+    return {
+        "counters": dict(counters),
+        "gauges": dict(gauges),
+        "histograms": {name: histogram.summary() for name, histogram in histograms.items()},
+    }
@@ -0,0 +1,139 @@
+import heapq
+import itertools
+import time
+
+import utils.metrics as metrics
+
+# Refresh priorities, lower runs first
+PRIORITY_NEW = 0  # just added to a guild
+PRIORITY_QUERIED = 1  # just looked up by a command
+PRIORITY_REPORT = 2  # member of a guild with an upcoming automated report
+PRIORITY_NORMAL = 3  # regular refresh
+
+# Histogram buckets for queue wait times, in seconds
+WAIT_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+class _Entry:
+    __slots__ = ("due", "priority", "dormant", "version")
+
+    def __init__(self, due):
+        self.due = due
+        self.priority = PRIORITY_NORMAL
+        self.dormant = 0  # refreshes in a row that found nothing new
+        self.version = 0
+
+
+# Schedules periodic refreshes of many keys (e.g. summoners), most urgent first
+# Every key is refreshed every interval seconds, keys whose refreshes keep finding nothing new back off
+# exponentially up to max_backoff seconds, and bump() moves a key to the front of the queue
+# Waiting keys sit in a heap ordered by due time, due keys in a heap ordered by (priority, due time)
+# Superseded heap entries are skipped lazily using a per-key version
+# Records "<name>.queue_depth" (due keys), "<name>.wait_seconds" (time from due to picked up) and "<name>.bumps"
+class RefreshScheduler:
+    def __init__(self, name, interval, max_backoff):
+        self.name = name
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self._entries = {}
+        self._waiting = []  # (due, seq, key, version)
+        self._ready = []  # (priority, due, seq, key, version)
+        self._seq = itertools.count()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Starts refreshing a key, the first refresh is due right away
+    def track(self, key):
+        if key not in self._entries:
+            self._entries[key] = _Entry(time.monotonic())
+            self._push(key)
+
+    # Stops refreshing a key
+    def untrack(self, key):
+        self._entries.pop(key, None)
+
+    # Keeps exactly the given keys, tracking new ones and dropping the others
+    def sync(self, keys):
+        keys = set(keys)
+        for key in list(self._entries):
+            if key not in keys:
+                self.untrack(key)
+        for key in keys:
+            self.track(key)
+
+    # Makes a key due now with at least the given priority, tracking it if needed
+    def bump(self, key, priority):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.track(key)
+            entry = self._entries[key]
+
+        now = time.monotonic()
+        if entry.due <= now and entry.priority <= priority:
+            return
+        entry.due = min(entry.due, now)
+        entry.priority = min(entry.priority, priority)
+        entry.dormant = 0
+        self._push(key)
+        metrics.incr(f"{self.name}.bumps")
+
+    # Returns up to limit due keys, most urgent first
+    # Every returned key has to be reported back with complete() or retry()
+    def pop_due(self, limit):
+        now = time.monotonic()
+        while self._waiting and self._waiting[0][0] <= now:
+            due, seq, key, version = heapq.heappop(self._waiting)
+            entry = self._entries.get(key)
+            if entry is not None and entry.version == version:
+                heapq.heappush(self._ready, (entry.priority, due, seq, key, version))
+
+        keys = []
+        while self._ready and len(keys) < limit:
+            priority, due, seq, key, version = heapq.heappop(self._ready)
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version:
+                continue
+            entry.version += 1  # in flight, until complete() or retry() schedules it again
+            keys.append(key)
+            metrics.observe(f"{self.name}.wait_seconds", now - due, WAIT_BUCKETS)
+
+        metrics.gauge(f"{self.name}.queue_depth", self.depth())
+        return keys
+
+    # Returns the number of keys currently due
+    def depth(self):
+        return sum(
+            1 for priority, due, seq, key, version in self._ready
+            if key in self._entries and self._entries[key].version == version
+        )
+
+    # Schedules a key's next refresh after a successful one
+    # found_new resets the backoff, otherwise the key is refreshed half as often as before
+    def complete(self, key, found_new):
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+
+        entry.dormant = 0 if found_new else entry.dormant + 1
+        delay = min(self.interval * 2 ** entry.dormant, self.max_backoff)
+        self._schedule(key, entry, delay)
+
+    # Schedules a key again after a failed or partial refresh, keeping its priority
+    def retry(self, key, delay=None):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._schedule(key, entry, self.interval if delay is None else delay, entry.priority)
+
+    def _schedule(self, key, entry, delay, priority=PRIORITY_NORMAL):
+        entry.due = time.monotonic() + delay
+        entry.priority = priority
+        self._push(key)
+
+    def _push(self, key):
+        entry = self._entries[key]
+        entry.version += 1
+        heapq.heappush(self._waiting, (entry.due, next(self._seq), key, entry.version))
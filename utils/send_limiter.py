@@ -0,0 +1,47 @@
+import asyncio
+import time
+
+from config import DISCORD_CHANNEL_SEND_LIMIT, DISCORD_GLOBAL_SEND_LIMIT
+from data.rate_limit import RateLimitBucket, parse_rate_limit_header
+import utils.metrics as metrics
+from utils.cache import LRUCache
+
+
+# Proactive limiter for messages the bot sends on its own (e.g. automated reports)
+# Sends wait in acquire() until they fit in the global bucket and in their channel's bucket,
+# so bulk sends do not run into Discord's 429s and slow down replies to commands
+# Time spent waiting is recorded in the "discord.send_wait_seconds" histogram
+class SendLimiter:
+    def __init__(self, global_limits, channel_limits):
+        self.global_bucket = RateLimitBucket(parse_rate_limit_header(global_limits))
+        self.channel_limits = parse_rate_limit_header(channel_limits)
+        self.channel_buckets = LRUCache(maxsize=10000)
+
+    # Waits until a message can be sent to the channel, then counts it
+    async def acquire(self, channel_id):
+        channel_bucket = self.channel_buckets.get(channel_id)
+        if channel_bucket is None:
+            channel_bucket = RateLimitBucket(self.channel_limits)
+            self.channel_buckets.set(channel_id, channel_bucket)
+
+        buckets = (self.global_bucket, channel_bucket)
+        started = time.monotonic()
+        while True:
+            now = time.monotonic()
+            wait = max(bucket.delay(now) for bucket in buckets)
+            if wait <= 0:
+                for bucket in buckets:
+                    bucket.consume(now)
+                break
+            await asyncio.sleep(wait)
+
+        metrics.observe("discord.send_wait_seconds", time.monotonic() - started)
+
+    # Sends a message to a channel once the limits allow it
+    async def send(self, channel, *args, **kwargs):
+        await self.acquire(channel.id)
+        return await channel.send(*args, **kwargs)
+
+
+# Limiter shared by every message the bot sends on its own
+send_limiter = SendLimiter(DISCORD_GLOBAL_SEND_LIMIT, DISCORD_CHANNEL_SEND_LIMIT)
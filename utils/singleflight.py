@@ -0,0 +1,46 @@
+import asyncio
+
+import utils.metrics as metrics
+
+
+# Coalesces identical concurrent calls so they share one in-flight execution
+# The first caller for a key runs the work, every caller arriving before it finishes awaits the same result
+# Once every caller of an execution is cancelled the execution is cancelled too, e.g. aborting an HTTP request
+# nobody waits for anymore
+# Counts executions in "<name>.calls", coalesced callers in "<name>.deduped" and abandoned executions in "<name>.cancelled"
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self._in_flight = {}  # key -> task
+        self._waiters = {}  # task -> number of callers awaiting it
+
+    async def do(self, key, func, *args, **kwargs):
+        task = self._in_flight.get(key)
+        if task is not None:
+            metrics.incr(f"{self.name}.deduped")
+        else:
+            metrics.incr(f"{self.name}.calls")
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+
+        # Shield the shared task so one cancelled caller does not cancel it for everyone else
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+                if not task.done():
+                    # The last caller was cancelled, callers arriving from now on start a new execution
+                    metrics.incr(f"{self.name}.cancelled")
+                    self._forget(key, task)
+                    task.cancel()
+
+    def _forget(self, key, task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+
+    def __len__(self):
+        return len(self._in_flight)
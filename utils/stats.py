@@ -1,73 +1,236 @@
+import hashlib
+import numpy as np
+from dataclasses import dataclass
+
+
+# Definition of one stat calculated for a summoner
+#   name: stable identifier, used for the stat's field in aggregation results and daily rollups
+#   label: display label, also the stat's key in every stats dictionary
+#   aggregation: how the matches are combined
+#       "count" the number of matches, "sum" a total, "avg" a total averaged over the matches, "max" the highest value
+#   source: "participant" for a participant field, "challenges" for a field of the participant's challenges object
+#   field: name of the field read from the source
+#   default: value used for matches without the field
+@dataclass(frozen=True)
+class StatDefinition:
+    name: str
+    label: str
+    aggregation: str
+    source: str = "participant"
+    field: str = None
+    default: float = 0
+
+    # Path of the field inside a participant, e.g. "kills" or "challenges.kda"
+    @property
+    def path(self):
+        if self.source == "challenges":
+            return f"challenges.{self.field}"
+        return self.field
+
+    # Reads the stat's value from a participant
+    def read(self, participant):
+        if self.source == "challenges":
+            return participant.get("challenges", {}).get(self.field, self.default)
+        return participant.get(self.field, self.default)
+
+
+# Every stat calculated for a summoner, in display order
+# The stats engines, database projections, aggregation pipelines, daily rollups and embeds are all
+# built from this table, so a stat is added or changed here only
+STATS = [
+    StatDefinition("matches", "🎮 Total Matches", "count", source=None),
+    StatDefinition("kills", "🔪 Avg. Kills", "avg", field="kills"),
+    StatDefinition("deaths", "💀 Avg. Deaths", "avg", field="deaths"),
+    StatDefinition("kda", "🗡 Avg. KDA", "avg", "challenges", "kda"),
+    StatDefinition("solo_kills", "🔪 Avg. Solo Kills", "avg", "challenges", "soloKills"),
+    StatDefinition("vision_score", "👁 Avg. Vision Score", "avg", field="visionScore"),
+    StatDefinition("team_damage_percentage", "🤝 Avg. Team Damage Percentage", "avg", "challenges", "teamDamagePercentage"),
+    StatDefinition("assists", "🤝 Avg. Assists", "avg", field="assists"),
+    StatDefinition("kill_participation", "🤝 Avg. Kill Participation", "avg", "challenges", "killParticipation"),
+    StatDefinition("gold_per_minute", "👑 Avg. Gold Per Minute", "avg", "challenges", "goldPerMinute"),
+    StatDefinition("damage_per_minute", "💥 Avg. Damage Per Minute", "avg", "challenges", "damagePerMinute"),
+    StatDefinition("damage_to_champions", "💥 Avg. Damage To Champions", "avg", field="totalDamageDealtToChampions"),
+    StatDefinition("assist_me_pings", "🙃 Avg. Assist Me Pings", "avg", field="assistMePings"),
+    StatDefinition("enemy_missing_pings", "🤔 Avg. Enemy Missing Pings", "avg", field="enemyMissingPings"),
+    StatDefinition("control_wards_placed", "👀 Avg. Control Wards Placed", "avg", "challenges", "controlWardsPlaced"),
+    StatDefinition("ability_uses", "🖖 Ability Uses", "sum", "challenges", "abilityUses"),
+    # Surrendered games are counted by adding the gameEndedInSurrender flag
+    StatDefinition("games_surrendered", "🏳 Games Surrendered", "sum", field="gameEndedInSurrender"),
+    StatDefinition("scuttle_crab_kills", "🐸 Scuttle Crab Kills", "sum", "challenges", "scuttleCrabKills"),
+]
+
+# Stats read from a participant field, every stat except the match count
+FIELD_STATS = [stat for stat in STATS if stat.aggregation != "count"]
+
+# Fingerprint of the stat fields, stored with the data built from them (daily rollups, match slices)
+# Data written for other stat definitions has a different fingerprint and is rebuilt instead of being read
+STATS_FINGERPRINT = hashlib.sha1(
+    repr([(stat.name, stat.path, stat.aggregation, stat.default) for stat in FIELD_STATS]).encode()
+).hexdigest()
+
+# Label of the match count, every stats dictionary has it
+MATCHES_LABEL = next(stat.label for stat in STATS if stat.aggregation == "count")
+
+
+# Returns the participant fields needed to calculate every stat
+def participant_fields():
+    return ["puuid"] + [stat.path for stat in FIELD_STATS]
+
+
+# Returns the stats of a summoner without matches
+def empty_stats():
+    return {stat.label: 0 for stat in STATS}
+
+
+# Builds a match's participant index, {puuid: position in info.participants}
+# Stored on cached match documents as participant_index so a summoner's participant can be read directly
+def build_participant_index(match):
+    return {
+        participant["puuid"]: position
+        for position, participant in enumerate(match["info"]["participants"])
+    }
+
+
+# Returns a summoner's participant entry in a match, None if the summoner did not play in it
+# Uses the match's participant_index when it has one, matches stored without it are scanned
+def find_participant(match, summoner_puuid):
+    participants = match["info"]["participants"]
+    position = match.get("participant_index", {}).get(summoner_puuid)
+    if position is not None and position < len(participants):
+        participant = participants[position]
+        if participant.get("puuid") == summoner_puuid:
+            return participant
+
+    return next((obj for obj in participants if obj.get("puuid") == summoner_puuid), None)
+
+
 # Calculates stats for a summoner with a given set of matches data
 def calculate(summoner_puuid, matches_data):
-    data_keys = [
-        "🎮 Total Matches",
-        "🔪 Avg. Kills",
-        "💀 Avg. Deaths",
-        "🗡 Avg. KDA",
-        "🔪 Avg. Solo Kills",
-        "👁 Avg. Vision Score",
-        "🤝 Avg. Team Damage Percentage",
-        "🤝 Avg. Assists",
-        "🤝 Avg. Kill Participation",
-        "👑 Avg. Gold Per Minute",
-        "💥 Avg. Damage Per Minute",
-        "💥 Avg. Damage To Champions",
-        "🙃 Avg. Assist Me Pings",
-        "🤔 Avg. Enemy Missing Pings",
-        "👀 Avg. Control Wards Placed",
-        "🖖 Ability Uses",
-        "🏳 Games Surrendered",
-        "🐸 Scuttle Crab Kills",
-    ]
-    # Initialize the dictionary with keys set to 0
-    data = {key: 0 for key in data_keys}
-
     if matches_data:
-        data["🎮 Total Matches"] = len(matches_data)
+        participants = []
         for match in matches_data:
-            participants = match["info"]["participants"]
-            stats = next(
-                (obj for obj in participants if obj.get("puuid") == summoner_puuid),
-                None,
-            )
-            challenges = stats.get("challenges", {})
-
-            if stats.get("gameEndedInSurrender"):
-                data["🏳 Games Surrendered"] += 1
-
-            data["🔪 Avg. Kills"] += stats.get("kills")
-            data["💀 Avg. Deaths"] += stats.get("deaths")
-            data["👁 Avg. Vision Score"] += stats.get("visionScore")
-            data["👀 Avg. Control Wards Placed"] += challenges.get("controlWardsPlaced")
-            data["🙃 Avg. Assist Me Pings"] += stats.get("assistMePings")
-            data["🐸 Scuttle Crab Kills"] += challenges.get("scuttleCrabKills")
-            data["💥 Avg. Damage To Champions"] += stats.get(
-                "totalDamageDealtToChampions", 0
-            )
-            data["🤝 Avg. Assists"] += stats.get("assists", 0)
-            data["🖖 Ability Uses"] += challenges.get("abilityUses", 0)
-            data["🔪 Avg. Solo Kills"] += challenges.get("soloKills", 0)
-            data["🤔 Avg. Enemy Missing Pings"] += stats.get("enemyMissingPings", 0)
-            data["💥 Avg. Damage Per Minute"] += challenges.get("damagePerMinute", 0)
-            data["👑 Avg. Gold Per Minute"] += challenges.get("goldPerMinute", 0)
-            data["🗡 Avg. KDA"] += challenges.get("kda", 0)
-            data["🤝 Avg. Kill Participation"] += challenges.get("killParticipation", 0)
-            data["🤝 Avg. Team Damage Percentage"] += challenges.get(
-                "teamDamagePercentage", 0
-            )
-
-        # calculate averages
-        data = {
-            key: (value / len(matches_data) if "Avg." in key else value)
-            for key, value in data.items()
-        }
-        # Round values to 2 decimal places
-        rounded_data = {key: round(value, 2) for key, value in data.items()}
-
-        return rounded_data
+            participants.append(find_participant(match, summoner_puuid))
+
+        data = sum_participants(participants)
+        return finalize(data)
     else:
         print(
             f"Error calculating stats for summoner with puuid {summoner_puuid}. No matches data provided."
         )
-        return data
+        return empty_stats()
+
+
+# Combines the stat fields of a summoner's participant entries, one entry per match
+# Returns the running totals finalize() turns into stats: sums for "sum" and "avg" stats, the highest value for "max" stats
+def sum_participants(participants):
+    totals = empty_stats()
+    totals[MATCHES_LABEL] = len(participants)
+
+    for participant in participants:
+        for stat in FIELD_STATS:
+            value = stat.read(participant)
+            if stat.aggregation == "max":
+                totals[stat.label] = max(totals[stat.label], value)
+            else:
+                totals[stat.label] += value
+
+    return totals
+
+
+# Adds the running totals of other to totals, e.g. to combine the totals of several days
+def merge_totals(totals, other):
+    for stat in STATS:
+        if stat.aggregation == "max":
+            totals[stat.label] = max(totals[stat.label], other[stat.label])
+        else:
+            totals[stat.label] += other[stat.label]
+    return totals
+
+
+# Turns running totals into the final stats, averaging the "avg" stats over the total matches
+# Shared by every stats engine so they all average and round the same way
+def finalize(totals):
+    total_matches = totals[MATCHES_LABEL]
+    if not total_matches:
+        return empty_stats()
+
+    # calculate averages
+    data = {
+        stat.label: (
+            totals[stat.label] / total_matches if stat.aggregation == "avg" else totals[stat.label]
+        )
+        for stat in STATS
+    }
+    # Round values to 2 decimal places
+    return {key: round(value, 2) for key, value in data.items()}
+
+
+# Columnar version of calculate(), returns the same dictionary
+def calculate_vectorized(summoner_puuid, matches_data):
+    if not matches_data:
+        print(
+            f"Error calculating stats for summoner with puuid {summoner_puuid}. No matches data provided."
+        )
+        return empty_stats()
+
+    return calculate_batch([(summoner_puuid, matches_data)])[0]
+
+
+# Calculates the stats of many summoners at once, e.g. every member of a guild for a report
+# Takes a list of (summoner_puuid, matches_data) pairs and returns a list of stats in the same order
+def calculate_batch(summoners_matches):
+    participant_groups = []
+    for summoner_puuid, matches_data in summoners_matches:
+        participant_groups.append(
+            [find_participant(match, summoner_puuid) for match in matches_data or []]
+        )
+    return calculate_participants_batch(participant_groups)
+
+
+# Calculates stats for groups of participant entries (one group per summoner, one entry per match)
+# Every needed field of every match is extracted into one NumPy matrix, one stat field at a time,
+# then the totals and averages of all groups are computed with one reduction per aggregation
+def calculate_participants_batch(participant_groups):
+    counts = np.array([len(participants) for participants in participant_groups], dtype=np.int64)
+    if not counts.sum():
+        return [empty_stats() for participants in participant_groups]
+
+    # One row per stat field, filled column by column from the participants' dictionaries
+    # so each value costs a single dict.get, booleans (e.g. gameEndedInSurrender) become 1.0 / 0.0
+    # so surrenders are counted like in calculate()
+    participants = [participant for group in participant_groups for participant in group]
+    challenges = [participant.get("challenges", {}) for participant in participants]
+    values = np.empty((len(FIELD_STATS), len(participants)))
+    for row, stat in enumerate(FIELD_STATS):
+        entries = challenges if stat.source == "challenges" else participants
+        field, default = stat.field, stat.default
+        values[row] = [entry.get(field, default) for entry in entries]
+
+    # Reduce each group's columns, reduceat runs from each start up to the next one so empty groups are skipped
+    has_matches = counts > 0
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[has_matches]
+    aggregations = np.array([stat.aggregation for stat in FIELD_STATS])
+    results = np.zeros((len(participant_groups), len(FIELD_STATS)))
+    results[has_matches] = np.add.reduceat(values, starts, axis=1).T
+    if (aggregations == "max").any():
+        maxima = np.zeros_like(results)
+        maxima[has_matches] = np.maximum.reduceat(values, starts, axis=1).T
+        results = np.where(aggregations == "max", maxima, results)
+    results = np.where(aggregations == "avg", results / np.maximum(counts, 1)[:, None], results)
+
+    all_stats = []
+    for count, row in zip(counts.tolist(), results.tolist()):
+        if not count:
+            all_stats.append(empty_stats())
+            continue
+
+        stats = {MATCHES_LABEL: count}
+        for stat, value in zip(FIELD_STATS, row):
+            # Totals of whole numbers are kept as integers, as calculate() returns them
+            if stat.aggregation != "avg" and value.is_integer():
+                value = int(value)
+            # Round values to 2 decimal places
+            stats[stat.label] = round(value, 2)
+        all_stats.append({stat.label: stats[stat.label] for stat in STATS})
+
+    return all_stats